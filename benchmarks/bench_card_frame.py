@@ -0,0 +1,120 @@
+"""Compares the per-card render time of CardFrame, which reuses cached
+frame and badge layers, against the original implementation that drew
+every layer from scratch for each card. Also checks the two produce the
+same pixels.
+
+Run with: python -m benchmarks.bench_card_frame --cards 100
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageChops, ImageDraw
+from prettytable import PrettyTable
+
+import nyan_tcg_game.card_preview as card_preview
+from nyan_tcg_game.card_preview import CardFrame, inset_box
+from benchmarks.bench_previews import make_cards
+
+
+class LegacyCardFrame(CardFrame):
+    """CardFrame as it was before its static layers were cached"""
+    def __init__(self, card, image_directory):
+        self.card = card
+        self.load_image(image_directory)
+        self.create_preview_frame(600, 800)
+        self.draw_header()
+        self.draw_company()
+        self.draw_rarity()
+
+    def create_preview_frame(self, dim_w, dim_h):
+        self.preview = Image.new(mode="RGBA", size=(dim_w, dim_h), color=(0,0,0,0))
+        self.preview_draw = ImageDraw.Draw(self.preview)
+        border_outer_bbox = inset_box((0, 0, dim_w-1, dim_h-1), 1)
+        for bbox in (border_outer_bbox, inset_box(border_outer_bbox, 28)):
+            self.preview_draw.rounded_rectangle(bbox,
+                                                fill=card_preview.border_color,
+                                                radius=card_preview.border_radius,
+                                                width=card_preview.border_outline_width,
+                                                outline=(0, 0, 0))
+        border_inner_bbox = inset_box(border_outer_bbox, 28)
+
+        mask = Image.new(mode="RGBA", size=(dim_w, dim_h))
+        mask_draw = ImageDraw.Draw(mask)
+        mask_draw.rounded_rectangle(inset_box(border_inner_bbox, card_preview.border_outline_width),
+                                    fill=(255, 255, 255, 255),
+                                    radius=card_preview.border_radius-card_preview.border_outline_width-1)
+
+        card_w, card_h = self.card_image.size
+        offset = ((dim_w - card_w) // 2, (dim_h - card_h) // 2)
+        overlay = Image.new(mode="RGBA", size=(dim_w, dim_h))
+        overlay.paste(self.card_image, offset)
+        self.preview.paste(overlay, mask=mask)
+
+    def draw_textbox(self, bbox, text, font_size):
+        return card_preview.draw_textbox(self.preview_draw, bbox, text, font_size)
+
+    def draw_header(self):
+        self.draw_textbox(card_preview.get_header_bbox(self.preview.size[0]), self.card.card_name, 40)
+
+    def draw_company(self):
+        self.draw_textbox(card_preview.company_bbox, self.card.company, 40)
+
+    def draw_rarity(self):
+        bbox_center = self.draw_textbox(card_preview.rarity_bbox, None, 0)
+        self.preview_draw.text((bbox_center[0] - 30, bbox_center[1]), "1",
+                               fill=card_preview.textbox_color, anchor="mm",
+                               stroke_fill="black", stroke_width=2, font_size=35)
+        self.preview_draw.text((bbox_center[0] + 48, bbox_center[1]), self.card.rarity.short_name,
+                               fill="gold", anchor="mm",
+                               stroke_fill="black", stroke_width=2, font_size=35)
+        self.preview_draw.line((526, 680, 526, 722), fill="black", width=2)
+
+
+def with_preloaded_images(frame_class, cards, image_directory):
+    """Returns frame_class with image loading replaced by a lookup of
+    already decoded images, so only the rendering itself is timed"""
+    images = {}
+    for card in cards:
+        with Image.open(os.path.join(image_directory, card.resized_uri)) as image:
+            images[card.resized_uri] = image.copy()
+
+    class PreloadedFrame(frame_class):
+        def load_image(self, image_directory):
+            self.card_image = images[self.card.resized_uri]
+    return PreloadedFrame
+
+
+def time_frames(frame_class, cards, image_directory):
+    start = time.perf_counter()
+    previews = [frame_class(card, image_directory).preview for card in cards]
+    return previews, (time.perf_counter() - start) / len(cards)
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_card_frame')
+    parser.add_argument('--cards', type=int, default=50, help='Number of cards to render')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_directory = os.path.join(tmp, 'images')
+        cards = make_cards(args.cards, image_directory)
+
+        table = PrettyTable()
+        table.field_names = ['Implementation', 'ms/card', 'ms/card excluding decode']
+        results = {}
+        for label, frame_class in [('Uncached layers', LegacyCardFrame), ('Cached layers', CardFrame)]:
+            previews, total = time_frames(frame_class, cards, image_directory)
+            _, render = time_frames(with_preloaded_images(frame_class, cards, image_directory),
+                                    cards, image_directory)
+            results[label] = previews
+            table.add_row([label, f'{total * 1000:.2f}', f'{render * 1000:.2f}'])
+        print(table)
+        legacy, cached = results.values()
+        mismatched = sum(1 for a, b in zip(legacy, cached) if ImageChops.difference(a, b).getbbox())
+        print(f'{mismatched} of {len(cards)} previews differ between implementations')
+
+
+if __name__ == '__main__':
+    main()
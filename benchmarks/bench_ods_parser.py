@@ -0,0 +1,68 @@
+"""Compares how many times the spreadsheet is parsed, and how long it
+takes, when main reads its four sheets straight from the file versus
+through a shared ods_parser.Workbook.
+
+Run with: python -m benchmarks.bench_ods_parser --rows 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from pyexcel_ods import get_data
+from prettytable import PrettyTable
+
+import nyan_tcg_game.ods_parser as ods_parser
+from nyan_tcg_game.schemas import BundleType
+from benchmarks.synthetic import pack_sheets, write_workbook
+
+
+def make_sheet(filename, rows):
+    write_workbook(filename, pack_sheets(rows))
+
+
+def read_separately(filename):
+    """The pre-Workbook behaviour: every sheet read re-parses the file"""
+    parses = 0
+    for sheet_name in ['Cards', 'Card Groups', 'Character Groups', 'Bundle Groups']:
+        ods_parser.convert_to_row_dict(get_data(filename)[sheet_name])
+        parses += 1
+    return parses
+
+
+def read_with_workbook(filename):
+    with ods_parser.Workbook(filename) as workbook:
+        ods_parser.read_card_data(workbook)
+        for bundle_type in (BundleType.CARD, BundleType.CHARACTER, BundleType.BUNDLE):
+            ods_parser.read_bundle_data(workbook, bundle_type)
+        return workbook.parse_count
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_ods_parser')
+    parser.add_argument('--rows', type=int, default=10000, help='Number of card rows to generate')
+    parser.add_argument('--format', choices=['ods', 'xlsx'], default='ods', help='Spreadsheet format to generate')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, f'bench.{args.format}')
+        make_sheet(filename, args.rows)
+
+        table = PrettyTable()
+        table.field_names = ['Method', 'Parses', 'Seconds']
+        parses, elapsed = timed(read_separately, filename)
+        table.add_row(['get_data per sheet', parses, f'{elapsed:.2f}'])
+        parses, elapsed = timed(read_with_workbook, filename)
+        table.add_row(['Workbook', parses, f'{elapsed:.2f}'])
+        print(f'{args.rows} card rows, {os.path.getsize(filename)} byte {args.format} file')
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Measures preview rendering throughput in cards per second for
+different numbers of worker processes.
+
+Run with: python -m benchmarks.bench_previews --cards 200 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+from prettytable import PrettyTable
+
+from nyan_tcg_game.card_preview import generate_previews
+from nyan_tcg_game.cards import Card, Rarity
+from nyan_tcg_game.crop_recipes import OUTPUT_SIZE
+
+
+def make_cards(count, image_directory):
+    """Creates count cards, each with a distinct noisy cropped image"""
+    os.makedirs(image_directory, exist_ok=True)
+    rarities = list(Rarity)
+    cards = []
+    for i in range(count):
+        card = Card(name=f'Character {i}', variant=f'Variant {i}', character=f'Character {i}',
+                    company=f'Company {i % 20}', rarity=rarities[i % len(rarities)], image_credit='',
+                    source_url=None, image_file_uri=None, local_image_path=None, resized_uri=None,
+                    background_fill=(255, 255, 255, 0))
+        filename = card.get_image_filename('.png')
+        Image.effect_noise(OUTPUT_SIZE, random.randint(10, 100)).convert('RGBA').save(
+            os.path.join(image_directory, filename))
+        card.resized_uri = filename
+        cards.append(card)
+    return cards
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_previews')
+    parser.add_argument('--cards', type=int, default=100, help='Number of cards to render')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()],
+                        help='Worker counts to measure')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_directory = os.path.join(tmp, 'images')
+        cards = make_cards(args.cards, image_directory)
+
+        table = PrettyTable()
+        table.field_names = ['Workers', 'Seconds', 'Cards/s']
+        for workers in args.workers:
+            start = time.perf_counter()
+            generate_previews(cards, image_directory, os.path.join(tmp, f'previews_{workers}'), workers=workers)
+            elapsed = time.perf_counter() - start
+            table.add_row([workers, f'{elapsed:.2f}', f'{len(cards) / elapsed:.1f}'])
+        print(f'{os.cpu_count()} CPUs')
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
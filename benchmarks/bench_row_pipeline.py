@@ -0,0 +1,70 @@
+"""Measures the peak memory the spreadsheet-to-Card pipeline allocates on
+top of the parsed sheet, comparing the list-of-dicts path against the
+streaming Row path as the number of rows grows.
+
+Run with: python -m benchmarks.bench_row_pipeline --rows 1000 10000 50000
+"""
+import argparse
+import collections
+import time
+import tracemalloc
+
+from prettytable import PrettyTable
+
+import nyan_tcg_game.ods_parser as ods_parser
+from nyan_tcg_game.cards import parse_cards
+from benchmarks.synthetic import CARD_HEADER, RARITIES
+
+
+def make_sheet_data(rows):
+    data = [CARD_HEADER]
+    for i in range(rows):
+        data.append([f'Character {i // 3}', f'Variant {i}', f'Company {i % 50}', RARITIES[i % 3],
+                     f'@artist{i}', f'https://example.com/{i}', f'https://example.com/{i}.png'])
+    return data
+
+
+def list_pipeline(data):
+    """The pre-streaming behaviour: a full dict per row, then a list of Cards"""
+    row_dicts = ods_parser.convert_to_row_dict(data)
+    return sum(1 for _ in list(parse_cards(row_dicts)))
+
+
+def streaming_pipeline(data):
+    return sum(1 for _ in parse_cards(ods_parser.iter_rows(data)))
+
+
+def measure(func, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = func(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert count == len(data) - 1
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_row_pipeline')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='Row counts to measure')
+    args = parser.parse_args()
+
+    results = collections.defaultdict(dict)
+    for rows in args.rows:
+        data = make_sheet_data(rows)
+        results[rows]['list'] = measure(list_pipeline, data)
+        results[rows]['streaming'] = measure(streaming_pipeline, data)
+
+    table = PrettyTable()
+    table.field_names = ['Rows', 'List peak KiB', 'List s', 'Streaming peak KiB', 'Streaming s']
+    for rows, result in results.items():
+        list_peak, list_time = result['list']
+        stream_peak, stream_time = result['streaming']
+        table.add_row([rows, list_peak // 1024, f'{list_time:.2f}', stream_peak // 1024, f'{stream_time:.2f}'])
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Checks the startup cost of the headless commands against a budget. Each
+command is run on a small synthetic pack under python -X importtime, and
+its total import time, wall time and the heavy packages it loaded are
+reported. Exits with an error if a command goes over its import budget
+or loads a package it should not need.
+
+Run with: python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from prettytable import PrettyTable
+
+from benchmarks.synthetic import make_images, pack_sheets, write_workbook
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ['tkinter', 'numpy', 'PIL', 'pyexcel_io', 'pydantic', 'prettytable']
+# Import time budgets in milliseconds, and the packages each command must
+# not import
+BUDGETS = {
+    'download': (200, {'tkinter', 'numpy', 'PIL', 'pydantic'}),
+    'stats': (250, {'tkinter', 'numpy', 'PIL', 'pyexcel_io'}),
+    'preview': (300, {'tkinter', 'numpy', 'pyexcel_io'}),
+}
+
+
+def run_command(args, cwd):
+    """Runs main with args, returning (wall seconds, import times) where
+    import times maps each module imported to its cumulative microseconds"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'nyan_tcg_game.main', *args],
+                            cwd=cwd, capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': REPO})
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(f'{" ".join(args)} failed:\n{result.stderr}')
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imports[name.strip()] = (int(cumulative), not name[1:].startswith(' '))
+    return wall, imports
+
+def total_import_ms(imports):
+    """Import time of the top level imports, which include their children"""
+    return sum(cumulative for cumulative, top_level in imports.values() if top_level) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_startup')
+    parser.add_argument('--runs', type=int, default=5, help='Runs of each command, the fastest is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = make_images(os.path.join(tmp, 'sources'), 4, (300, 400))
+        sheet = os.path.join(tmp, 'pack.ods')
+        write_workbook(sheet, pack_sheets(12, [f'file:{os.path.join(tmp, "sources", image)}' for image in images]))
+        export_dir = os.path.join(tmp, 'export')
+        cache = ['--cache-dir', os.path.join(tmp, 'cache')]
+        run_command(['export', sheet, export_dir, 'Startup', '--auto-crop', '--preview', *cache], tmp)
+
+        commands = {
+            'download': ['download', sheet, *cache],
+            'stats': ['stats', export_dir],
+            'preview': ['preview', export_dir],
+        }
+        table = PrettyTable()
+        table.field_names = ['Command', 'Imports (ms)', 'Budget (ms)', 'Wall (ms)', 'Heavy imports', '']
+        failed = False
+        for name, command in commands.items():
+            runs = [run_command(command, tmp) for _ in range(args.runs)]
+            import_ms = min(total_import_ms(imports) for _, imports in runs)
+            wall_ms = statistics.median(wall for wall, _ in runs) * 1000
+            imported = {package for package in HEAVY if package in runs[0][1]}
+            budget, forbidden = BUDGETS[name]
+            problems = []
+            if import_ms > budget:
+                problems.append('over budget')
+            if imported & forbidden:
+                problems.append(f'imports {", ".join(sorted(imported & forbidden))}')
+            failed |= bool(problems)
+            table.add_row([name, f'{import_ms:.0f}', budget, f'{wall_ms:.0f}', ', '.join(sorted(imported)),
+                           '; '.join(problems) or 'ok'])
+        print(table)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compares generate_stats against the original stats queries on a
+synthetic pack, and checks both write the same tables. The original
+counted bundles per character through a single join of character
+bundles, cards and card bundles, which grows with the product of the
+three for every character.
+
+Run with: python -m benchmarks.bench_stats --cards 50000
+"""
+import argparse
+import contextlib
+import io
+import random
+import sqlite3
+import tempfile
+import time
+import os
+
+from prettytable import PrettyTable
+
+import nyan_tcg_game.stats as stats
+from nyan_tcg_game.cards import Rarity
+from nyan_tcg_game.schemas import Bundle, BundleType, NyanCard, Pack
+
+COMPANIES = ['NijiEN', 'HoloEN', 'Indie', 'Phase', 'VShojo']
+
+
+def make_pack(num_cards, cards_per_character=25, bundles_per_character=3, card_bundle_size=8, seed=0):
+    rng = random.Random(seed)
+    num_characters = max(num_cards // cards_per_character, 1)
+    characters = [f'Character {i}' for i in range(num_characters)]
+    cards = []
+    for i in range(num_cards):
+        character = characters[i % num_characters]
+        cards.append(NyanCard(name=f'{character} ({i})', subtext=rng.choice(COMPANIES), character=character,
+                              image_url=f'images/{i}.png', image_credit='@artist', image_source=None,
+                              rarity=rng.choice(list(Rarity))))
+    bundles = []
+    for i in range(num_characters * bundles_per_character // 4):
+        bundles.append(Bundle(name=f'Character Bundle {i}', bundle_type=BundleType.CHARACTER, cards=[],
+                              characters=rng.sample(characters, min(4, num_characters)), sub_bundles=[]))
+    for i in range(num_cards // 4):
+        bundles.append(Bundle(name=f'Card Bundle {i}', bundle_type=BundleType.CARD, characters=[],
+                              cards=[card.name for card in rng.sample(cards, card_bundle_size)], sub_bundles=[]))
+    return Pack(name='Synthetic', cards=cards, bundles=bundles)
+
+
+LEGACY_BUNDLE_MEMBERSHIP = '''
+    SELECT characters.character as character,
+       COUNT(DISTINCT character_bundles.bundle_name) + COUNT(DISTINCT card_bundles.bundle_name) as total_bundles,
+       COUNT(DISTINCT character_bundles.bundle_name) as num_character_bundles,
+       COUNT(DISTINCT card_bundles.bundle_name) as num_card_bundles
+    FROM characters
+        LEFT JOIN character_bundles ON characters.character = character_bundles.character_name
+        LEFT JOIN cards ON cards.character = characters.character
+        LEFT JOIN card_bundles ON cards.name = card_bundles.card_name
+    WHERE cards.character IS NOT NULL
+    GROUP BY characters.character ;
+    '''
+
+LEGACY_CHARACTER_RARITIES = '''
+    SELECT ch.character,
+    SUM(CASE WHEN ca.rarity = 'Common' THEN 1 ELSE 0 END) as common_count,
+    SUM(CASE WHEN ca.rarity = 'Rare' THEN 1 ELSE 0 END) as rare_count,
+    SUM(CASE WHEN ca.rarity = 'Special Rare' THEN 1 ELSE 0 END) as special_rare_count
+    FROM characters ch
+    LEFT JOIN cards ca ON ca.character = ch.character
+    WHERE ch.character IS NOT NULL
+    GROUP BY ch.character ORDER BY ch.character'''
+
+
+def legacy_stats(pack, stats_fp):
+    """The original stats queries, without indexes"""
+    with contextlib.closing(sqlite3.connect(':memory:')) as db:
+        stats.create_db(db)
+        stats.populate_db(db, pack)
+        stats_fp.write('Number of bundles per character:\n')
+        table = PrettyTable()
+        table.field_names = ["Character Name", "Total", "Char", "Card", "Attn"]
+        for row in db.execute(LEGACY_BUNDLE_MEMBERSHIP).fetchall():
+            table.add_row((*row, '*' if row[2] == 0 else ''))
+        stats_fp.write(str(table))
+        stats_fp.write('\n')
+        stats_fp.write('\n\n')
+        stats_fp.write('Rarities per character:\n')
+        table = PrettyTable()
+        table.field_names = ["Character Name", "C", "R", "SR", "Attn"]
+        for row in db.execute(LEGACY_CHARACTER_RARITIES).fetchall():
+            table.add_row((*row, '*' if row[1] == 0 else ''))
+        stats_fp.write(str(table))
+        stats_fp.write('\n')
+        stats_fp.write('\n\n')
+        stats.print_subtexts(db, stats_fp)
+        stats_fp.write('\n\n')
+        stats.print_totals(db, stats_fp)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--cards-per-character', type=int, default=25)
+    parser.add_argument('--skip-legacy', action='store_true', help='Only time the current implementation')
+    args = parser.parse_args()
+
+    pack = make_pack(args.cards, args.cards_per_character)
+    print(f'{len(pack.cards)} cards, {len(pack.bundles)} bundles')
+
+    with tempfile.TemporaryDirectory() as directory:
+        stats_file = os.path.join(directory, 'pack_stats.txt')
+        start = time.perf_counter()
+        stats.generate_stats(pack, stats_file)
+        current = time.perf_counter() - start
+        # Stats used to fail on a second call in the same process
+        stats.generate_stats(pack, stats_file)
+        with open(stats_file) as f:
+            current_output = f.read()
+
+    table = PrettyTable()
+    table.field_names = ['Implementation', 'Seconds']
+    table.add_row(['generate_stats', f'{current:.2f}'])
+    if not args.skip_legacy:
+        legacy_output = io.StringIO()
+        start = time.perf_counter()
+        legacy_stats(pack, legacy_output)
+        legacy = time.perf_counter() - start
+        table.add_row(['original queries', f'{legacy:.2f}'])
+        print(f'Outputs identical: {legacy_output.getvalue() == current_output}')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
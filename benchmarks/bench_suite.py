@@ -0,0 +1,184 @@
+"""Times each stage of an export on a synthetic pack: spreadsheet parsing
+for each format, card and bundle parsing, downloads from a local HTTP
+server, previews, the pack JSON and the stats. Results are written as
+JSON, and passing an earlier results file compares against it.
+
+Run with: python -m benchmarks.bench_suite --cards 10000 --output results.json
+     and: python -m benchmarks.bench_suite --cards 10000 --compare results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+from PIL import Image
+from prettytable import PrettyTable
+
+import nyan_tcg_game.ods_parser as ods_parser
+from nyan_tcg_game.bundles import compile_bundles, parse_bundles
+from nyan_tcg_game.card_preview import generate_previews
+from nyan_tcg_game.cards import parse_cards
+from nyan_tcg_game.crop_recipes import OUTPUT_SIZE
+from nyan_tcg_game.downloader import Downloader
+from nyan_tcg_game.image_files import download_missing_images
+from nyan_tcg_game.json_export import export_pack_json
+from nyan_tcg_game.schemas import BundleType, NyanCard, Pack
+from nyan_tcg_game.stats import generate_stats
+from benchmarks.synthetic import make_images, pack_sheets, serve_directory, write_workbook
+
+# A stage this much slower than in the compared run is flagged
+REGRESSION_THRESHOLD = 0.10
+
+
+class Suite:
+    def __init__(self):
+        self.results = {}
+
+    def time(self, name, func, *args, items=None):
+        """Runs func, recording how long it took and, when items is given,
+        how many it handled per second"""
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        self.results[name] = {'seconds': elapsed}
+        count = items(result) if callable(items) else items
+        if count is not None:
+            self.results[name]['items'] = count
+            self.results[name]['per_second'] = count / elapsed if elapsed else None
+        print(f'{name}: {elapsed:.2f}s' + (f' ({count} items)' if count is not None else ''))
+        return result
+
+
+def read_workbook(filename):
+    """Reads all four sheets the way main does"""
+    with ods_parser.Workbook(filename) as workbook:
+        for sheet_name in ['Cards', *ods_parser.BUNDLE_SHEETS.values()]:
+            workbook.read_sheet(sheet_name)
+        return workbook
+
+def read_bundle_rows(workbook):
+    return [row for bundle_type in (BundleType.CARD, BundleType.CHARACTER, BundleType.BUNDLE)
+            for row in ods_parser.iter_bundle_data(workbook, bundle_type)]
+
+def download_cards(cards, cache_dir, workers):
+    with Downloader(max_workers=workers, host_limits={'127.0.0.1': workers}) as downloader:
+        return list(download_missing_images(cards, cache_dir, downloader))
+
+def make_crops(cards, image_directory):
+    """Points every card at a crop of its source image, made once per
+    source, so previews can be rendered without the crop GUI"""
+    os.makedirs(image_directory, exist_ok=True)
+    crops = {}
+    for card in cards:
+        if card.local_image_path not in crops:
+            filename = f'crop_{len(crops)}.png'
+            with Image.open(card.local_image_path) as image:
+                image.convert('RGBA').resize(OUTPUT_SIZE).save(os.path.join(image_directory, filename))
+            crops[card.local_image_path] = filename
+        card.resized_uri = crops[card.local_image_path]
+
+
+def run(args, directory):
+    suite = Suite()
+    source_dir = os.path.join(directory, 'sources')
+    # Generating the images is setup, not one of the timed stages
+    filenames = make_images(source_dir, args.images, tuple(args.image_size))
+
+    with serve_directory(source_dir) as base_url:
+        uris = [f'{base_url}/{filename}' for filename in filenames]
+        sheets = pack_sheets(args.cards, uris)
+
+        workbook = None
+        for extension in args.format:
+            filename = os.path.join(directory, f'pack.{extension}')
+            write_workbook(filename, sheets)
+            workbook = suite.time(f'ods_parser[{extension}]', read_workbook, filename, items=args.cards)
+
+        cards = suite.time('parse_cards', lambda: list(parse_cards(ods_parser.iter_card_data(workbook))),
+                           items=len)
+        cards = suite.time('downloads', download_cards, cards, os.path.join(directory, 'cache'),
+                           args.download_workers, items=args.images)
+
+    bundle_rows = read_bundle_rows(workbook)
+    bundles = suite.time('parse_bundles', parse_bundles, bundle_rows, cards, items=len(bundle_rows))
+    nyancards = list(map(NyanCard.from_card, cards))
+    compiled = suite.time('compile_bundles', compile_bundles, bundles, nyancards, items=len(bundles))
+    pack = Pack(name='Synthetic', cards=nyancards, bundles=bundles,
+                bundle_cards={name: sorted(members) for name, members in compiled.members.items()},
+                card_bundles=compiled.card_bundles)
+    suite.time('export_pack_json', export_pack_json, pack, os.path.join(directory, 'pack_data.json'),
+               items=len(nyancards))
+    suite.time('generate_stats', generate_stats, pack, os.path.join(directory, 'pack_stats.txt'),
+               items=len(nyancards))
+
+    if args.preview_cards:
+        preview_cards = cards[:args.preview_cards]
+        image_directory = os.path.join(directory, 'images')
+        make_crops(preview_cards, image_directory)
+        suite.time('generate_previews', generate_previews, preview_cards, image_directory,
+                   os.path.join(directory, 'previews'), None, args.workers, items=len(preview_cards))
+    return suite.results
+
+
+def compare(results, baseline):
+    table = PrettyTable()
+    table.field_names = ['Stage', 'Baseline (s)', 'Now (s)', 'Change', '']
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            table.add_row([name, '-', f"{result['seconds']:.2f}", '', 'new'])
+            continue
+        change = result['seconds'] / before['seconds'] - 1 if before['seconds'] else 0
+        table.add_row([name, f"{before['seconds']:.2f}", f"{result['seconds']:.2f}", f'{change:+.0%}',
+                       'slower' if change > REGRESSION_THRESHOLD else ''])
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser('bench_suite')
+    parser.add_argument('--cards', type=int, default=10000, help='Number of cards in the pack')
+    parser.add_argument('--images', type=int, default=200, help='Number of distinct source images')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[900, 1200], metavar=('W', 'H'),
+                        help='Size of the source images')
+    parser.add_argument('--format', choices=['ods', 'xlsx'], nargs='+', default=['ods', 'xlsx'],
+                        help='Spreadsheet formats to time, the last one is used for the later stages')
+    parser.add_argument('--preview-cards', type=int, default=200, help='Number of cards to render previews of')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for previews')
+    parser.add_argument('--download-workers', type=int, default=8)
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', type=str, default=None, help='Results file of an earlier run to compare to')
+    parser.add_argument('--keep', type=str, default=None,
+                        help='Directory to generate into and keep, source images there are reused between runs')
+    args = parser.parse_args()
+
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        results = run(args, args.keep)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, directory)
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['config'] != report['config']:
+            print(f"Warning: {args.compare} was run with {baseline['config']}")
+        print(compare(results, baseline['results']))
+
+
+if __name__ == '__main__':
+    main()
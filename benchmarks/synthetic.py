@@ -0,0 +1,95 @@
+"""Synthetic packs for the benchmarks: spreadsheets in the layout the
+exporter reads, a corpus of source images, and a local HTTP server to
+download them from.
+"""
+import contextlib
+import functools
+import http.server
+import os
+import random
+import threading
+
+import pyexcel
+from PIL import Image, ImageDraw
+
+CARD_HEADER = ['Name', 'Variant', 'Company', 'Rarity', 'Credit', 'Source URL', 'File URI', 'Notes', 'Group']
+RARITIES = ['Common', 'Rare', 'Special Rare']
+COMPANIES = 50
+
+
+def pack_sheets(num_cards, image_uris=None, cards_per_character=3, characters_per_group=4, card_group_size=7,
+                groups_per_bundle=10):
+    """Returns the four sheets of a pack with num_cards cards, as
+    {sheet name: rows}. Cards cycle through image_uris, which default to
+    URLs that are never fetched"""
+    num_characters = max(num_cards // cards_per_character, 1)
+    cards = [CARD_HEADER]
+    for i in range(num_cards):
+        uri = image_uris[i % len(image_uris)] if image_uris else f'https://example.com/{i}.png'
+        cards.append([f'Character {i % num_characters}', f'Variant {i}', f'Company {i % COMPANIES}',
+                      RARITIES[i % len(RARITIES)], f'@artist{i}', f'https://example.com/{i}', uri, '', ''])
+    num_groups = max(num_characters // characters_per_group, 1)
+    character_groups = [['Group Name', 'Name']] + [[f'Group {i % num_groups}', f'Character {i}']
+                                                   for i in range(num_characters)]
+    card_groups = [['Group Name', 'Name', 'Variant']] + [
+        [f'Set {i // card_group_size}', f'Character {i % num_characters}', f'Variant {i}']
+        for i in range(0, num_cards, 3)]
+    bundle_groups = [['Group Name', 'Name']] + [[f'Super {i // groups_per_bundle}', f'Group {i}']
+                                                for i in range(num_groups)]
+    return {'Cards': cards,
+            'Character Groups': character_groups,
+            'Card Groups': card_groups,
+            'Bundle Groups': bundle_groups}
+
+def write_workbook(filename, sheets):
+    """Saves sheets as an ODS or XLSX file, going by the extension"""
+    pyexcel.Book(sheets).save_as(filename)
+
+
+def make_image(filename, size, seed):
+    """A distinct image of colored shapes over a gradient, which compresses
+    more like artwork than noise does"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x1, y1 = rng.randrange(size[0]), rng.randrange(size[1])
+        x2, y2 = x1 + rng.randrange(size[0] // 2 + 1), y1 + rng.randrange(size[1] // 2 + 1)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x1, y1, x2, y2), fill=color)
+        else:
+            draw.rectangle((x1, y1, x2, y2), fill=color)
+    image.save(filename)
+
+def make_images(directory, count, size=(900, 1200), extension='.png'):
+    """Writes count distinct source images to directory, returning their
+    filenames relative to it. Images already there are reused"""
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for i in range(count):
+        filename = f'source_{i}_{size[0]}x{size[1]}{extension}'
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            make_image(path, size, i)
+        filenames.append(filename)
+    return filenames
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+@contextlib.contextmanager
+def serve_directory(directory):
+    """Serves directory over HTTP on a free local port for the duration of
+    the block, yielding its base URL"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
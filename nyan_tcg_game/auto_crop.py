@@ -0,0 +1,157 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from nyan_tcg_game.build_manifest import card_key
+from nyan_tcg_game import profiling
+from nyan_tcg_game.crop_recipes import (VISIBLE_SIZE, CropRecipe, composite_background, find_crops_needed,
+                                        get_crop_bbox_from_view_bbox, save_crop, update_crop_status)
+
+logger = logging.getLogger(__name__)
+
+# Saliency is scored on a copy of the image no larger than this
+ANALYSIS_SIZE = 256
+# Side of the square blocks local entropy is measured over
+ENTROPY_BLOCK = 8
+ENTROPY_LEVELS = 16
+# Visible window sizes tried, relative to the largest that fits the image
+WINDOW_SCALES = (1.0, 0.9, 0.8, 0.7, 0.6)
+# Candidate windows are placed on a grid of roughly this many steps across
+WINDOW_STEPS = 48
+# How strongly a smaller window is favoured when it holds nearly as much
+# of the image's saliency as a larger one. At 0 the largest window always
+# wins, a uniformly busy image always gets the largest window below 1
+TIGHTNESS = 0.3
+
+
+def load_analysis_image(path, background_fill=(0, 0, 0, 0)):
+    """Returns (grayscale array, scale) for a reduced copy of the image,
+    where scale maps source pixels onto the array"""
+    with Image.open(path) as image:
+        full_width = image.width
+        if image.format == 'JPEG':
+            image.draft('RGB', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+        # Transparent areas are scored as the opaque fill they end up on
+        image = composite_background(image, tuple(background_fill[:3]) + (255, ))
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR)
+    gray = np.asarray(image.convert('L'), dtype=np.float32)
+    return gray, image.width / full_width
+
+def edge_map(gray):
+    """Gradient magnitude of each pixel"""
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:] = np.abs(np.diff(gray, axis=1))
+    gy[1:, :] = np.abs(np.diff(gray, axis=0))
+    return gx + gy
+
+def entropy_map(gray, block=ENTROPY_BLOCK, levels=ENTROPY_LEVELS):
+    """Shannon entropy of the gray levels in the block around each pixel"""
+    h, w = gray.shape
+    bh, bw = max(h // block, 1), max(w // block, 1)
+    quantized = (gray[:bh * block, :bw * block] * (levels / 256)).astype(np.intp)
+    blocks = quantized.reshape(bh, block, bw, block).transpose(0, 2, 1, 3).reshape(bh, bw, -1)
+    counts = (blocks[..., None] == np.arange(levels)).sum(axis=2)
+    p = counts / blocks.shape[-1]
+    logp = np.log2(p, where=p > 0, out=np.zeros_like(p))
+    entropy = -(p * logp).sum(axis=-1)
+    # Spread each block's entropy back over its pixels, padding the edges
+    # that did not fill a whole block
+    entropy = np.repeat(np.repeat(entropy, block, axis=0), block, axis=1)
+    return np.pad(entropy, ((0, h - entropy.shape[0]), (0, w - entropy.shape[1])), mode='edge')
+
+def saliency_map(gray):
+    def normalized(values):
+        mean = values.mean()
+        return values / mean if mean > 0 else values
+    return normalized(edge_map(gray)) + normalized(entropy_map(gray))
+
+def best_window(saliency, aspect=VISIBLE_SIZE[0] / VISIBLE_SIZE[1]):
+    """Scores every candidate window of the given width/height aspect
+    against a summed area table of saliency and returns the best one as
+    (x1, y1, x2, y2)"""
+    h, w = saliency.shape
+    table = np.zeros((h + 1, w + 1), dtype=np.float64)
+    table[1:, 1:] = saliency.cumsum(axis=0).cumsum(axis=1)
+    total = table[-1, -1] or 1.0
+
+    max_w = min(w, h * aspect)
+    max_h = max_w / aspect
+    step = max(1, min(w, h) // WINDOW_STEPS)
+    windows = []
+    scores = []
+    for scale in WINDOW_SCALES:
+        ww, wh = max(int(max_w * scale), 1), max(int(max_h * scale), 1)
+        xs, ys = np.meshgrid(np.arange(0, w - ww + 1, step), np.arange(0, h - wh + 1, step))
+        xs, ys = xs.ravel(), ys.ravel()
+        sums = table[ys + wh, xs + ww] - table[ys, xs + ww] - table[ys + wh, xs] + table[ys, xs]
+        scores.append(sums / total - TIGHTNESS * scale ** 2)
+        windows.append(np.stack([xs, ys, xs + ww, ys + wh], axis=1))
+    windows = np.concatenate(windows)
+    return tuple(int(v) for v in windows[np.argmax(np.concatenate(scores))])
+
+def suggest_view_bbox(path, background_fill=(0, 0, 0, 0)):
+    """Suggests the visible window of a card's image in source pixels"""
+    gray, scale = load_analysis_image(path, background_fill)
+    return tuple(round(v / scale) for v in best_window(saliency_map(gray)))
+
+def auto_crop_card(source_path, source_hash, background_fill, output_path):
+    """Picks a crop for one image and saves it, returning the suggested
+    visible window and the recipe of the saved crop"""
+    view_bbox = suggest_view_bbox(source_path, background_fill)
+    bbox = tuple(int(c) for c in get_crop_bbox_from_view_bbox(view_bbox))
+    recipe = CropRecipe(source_hash, bbox, tuple(background_fill))
+    save_crop(recipe, source_path, output_path)
+    return view_bbox, recipe
+
+
+def auto_crop_images(cards, output_directory, export_prefix, manifest=None, recipes=None, workers=None,
+                     review=False):
+    """Crops every card without a cropped image without opening the GUI,
+    spread across a process pool. With review, the crop GUI is then opened
+    over the cards that were cropped with each suggestion already drawn,
+    so they can be checked and redone"""
+    os.makedirs(output_directory, exist_ok=True)
+    cards = list(cards)
+    needed, _ = find_crops_needed(cards, output_directory, export_prefix, manifest)
+
+    suggestions = {}
+    cropped = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [profiling.submit(executor, card.card_name, 'crop', auto_crop_card, card.local_image_path,
+                                    card.source_image_hash, card.background_fill,
+                                    os.path.join(export_prefix, card.resized_uri))
+                   for card in needed]
+        for index, (card, future) in enumerate(zip(needed, futures)):
+            try:
+                view_bbox, recipe = future.result()
+            except Exception as e:
+                logger.error(f'Failed to auto crop {card.card_name}: {e}')
+                continue
+            logger.info(f'[{index + 1}/{len(needed)}] Auto cropped {card.resized_uri}')
+            profiling.add_written(os.path.join(export_prefix, card.resized_uri))
+            suggestions[card_key(card)] = view_bbox
+            cropped.append(card)
+            if recipes:
+                recipes.set(card, recipe)
+            if manifest:
+                manifest.record_crop(card, os.path.join(export_prefix, card.resized_uri))
+    if needed:
+        elapsed = time.perf_counter() - start
+        logger.info(f'Auto cropped {len(cropped)} of {len(needed)} images in {elapsed:.1f}s')
+
+    if review and cropped:
+        # Only reviewing needs the GUI
+        from nyan_tcg_game.crop_gui import run_gui
+        run_gui(cropped, output_directory, manifest, recipes, suggestions=suggestions)
+    elif recipes:
+        recipes.save()
+
+    if manifest:
+        update_crop_status(cards, export_prefix, manifest)
+    return cards
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from nyan_tcg_game.downloader import write_atomic
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'build_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def hash_inputs(*values):
+    """Hashes any JSON-able values into a stable hex digest"""
+    encoded = json.dumps(values, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def hash_file(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_stamp(filename):
+    """A cheap fingerprint of a file on disk, None if it does not exist"""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def card_row_hash(card):
+    return hash_inputs(card.name, card.variant, card.character, card.company, card.rarity,
+                       card.image_credit, card.source_url, card.image_file_uri)
+
+def card_key(card):
+    return card.get_image_filename('')
+
+
+class BuildManifest:
+    """Records what every output in an export directory was built from,
+    so a rerun only rebuilds outputs whose inputs have changed.
+
+    Each output is stored under a name such as "crop/<card>" or
+    "pack_json" along with a hash of its inputs and the size and mtime of
+    the file that was written. Outputs that could not be built are kept
+    as failures, so a rerun with the same inputs retries them. Outputs
+    and failures not checked or recorded during a run are dropped when
+    the manifest is saved."""
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        self.filename = os.path.join(export_dir, MANIFEST_FILE)
+        data = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            data = {}
+        self.run = data.get('run')
+        self.outputs = data.get('outputs', {})
+        self.stale_crops = data.get('stale_crops', [])
+        self.missing_crops = data.get('missing_crops', [])
+        self.failed = data.get('failed', {})
+        self.seen = set()
+        # Whether anything was built or failed since the manifest was loaded
+        self.changed = False
+        # Stages running alongside the crop GUI check and record outputs too
+        self.lock = threading.RLock()
+
+    def _path(self, filename):
+        return os.path.relpath(filename, self.export_dir)
+
+    def up_to_date(self, run_inputs):
+        """True if the last run had the same inputs, finished every crop,
+        built every output, and none of its outputs have been touched since"""
+        if self.run != run_inputs or not self.outputs:
+            return False
+        if self.stale_crops or self.missing_crops or self.failed:
+            return False
+        return all(file_stamp(os.path.join(self.export_dir, output['path'])) == output['stamp']
+                   for output in self.outputs.values())
+
+    def is_current(self, name, inputs, filename):
+        with self.lock:
+            self.seen.add(name)
+            output = self.outputs.get(name)
+        return (output is not None
+                and output['inputs'] == inputs
+                and output['stamp'] == file_stamp(filename))
+
+    def record(self, name, inputs, filename, **extra):
+        output = {'inputs': inputs,
+                  'path': self._path(filename),
+                  'stamp': file_stamp(filename),
+                  **extra}
+        with self.lock:
+            self.seen.add(name)
+            self.outputs[name] = output
+            self.failed.pop(name, None)
+            self.changed = True
+
+    def record_failure(self, name, reason):
+        """Records that an output could not be built, dropping any earlier
+        build of it"""
+        with self.lock:
+            self.seen.add(name)
+            self.outputs.pop(name, None)
+            self.failed[name] = str(reason)
+            self.changed = True
+
+    def record_crop(self, card, filename):
+        self.record(f'crop/{card_key(card)}',
+                    hash_inputs(card.source_image_hash, card.background_fill),
+                    filename,
+                    source=card.source_image_hash)
+
+    def crop_is_stale(self, card, filename):
+        """True if an existing crop was made from a different source image
+        than the card now points at. Crops made before the manifest
+        existed are assumed to be correct, as are crops of the same source
+        that were changed outside the GUI. Those are recorded as they are
+        now, so what is built from them is rebuilt"""
+        name = f'crop/{card_key(card)}'
+        with self.lock:
+            self.seen.add(name)
+            output = self.outputs.get(name)
+        if output is not None and output['source'] != card.source_image_hash:
+            return True
+        if output is None or output['stamp'] != file_stamp(filename):
+            self.record_crop(card, filename)
+        return False
+
+    def set_crop_status(self, stale, missing):
+        self.stale_crops = sorted(card.card_name for card in stale)
+        self.missing_crops = sorted(card.card_name for card in missing)
+
+    def save(self, run_inputs):
+        with self.lock:
+            outputs = {name: output for name, output in sorted(self.outputs.items()) if name in self.seen}
+            failed = {name: reason for name, reason in sorted(self.failed.items()) if name in self.seen}
+        self._write(run_inputs, outputs, failed)
+
+    def save_partial(self):
+        """Saves after a command that only rebuilt some outputs, keeping
+        the others. The inputs of the last full run are kept only if
+        nothing was rebuilt, as what a full run builds from the rebuilt
+        outputs may now be out of date"""
+        with self.lock:
+            outputs = dict(sorted(self.outputs.items()))
+            failed = dict(sorted(self.failed.items()))
+        self._write(None if self.changed else self.run, outputs, failed)
+
+    def _write(self, run_inputs, outputs, failed):
+        data = {
+            'version': MANIFEST_VERSION,
+            'run': run_inputs,
+            'stale_crops': self.stale_crops,
+            'missing_crops': self.missing_crops,
+            'failed': failed,
+            'outputs': outputs,
+        }
+        write_atomic(self.filename, json.dumps(data, indent=2).encode('utf-8'))
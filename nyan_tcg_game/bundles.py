@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import defaultdict
+import itertools
 import logging
 from nyan_tcg_game.schemas import Bundle, BundleType
 from nyan_tcg_game.cards import Card
@@ -68,6 +69,114 @@ def parse_bundles(ods_data: list[dict],
                                   cards=cards,
                                   sub_bundles=sub_bundles))
     return bundles
-        
-            
-    
+
+
+@dataclass
+class CompiledBundles:
+    """Every bundle's full membership with sub-bundles resolved"""
+    # Bundle name to every card name it contains, directly, through its
+    # characters or through any of its sub-bundles
+    members: dict[str, frozenset[str]] = field(default_factory=dict)
+    # Card name to every bundle containing it
+    card_bundles: dict[str, list[str]] = field(default_factory=dict)
+    # Groups of bundles that contain each other
+    cycles: list[list[str]] = field(default_factory=list)
+    # (bundle, sub-bundle) pairs naming a sub-bundle that does not exist
+    missing: list[tuple[str, str]] = field(default_factory=list)
+
+    def bundles_for(self, card_name) -> list[str]:
+        return self.card_bundles.get(card_name, [])
+
+
+def compile_bundles(bundles: list[Bundle], cards) -> CompiledBundles:
+    """Resolves the sub-bundle hierarchy of bundles over cards (anything
+    with a name and character, such as NyanCards).
+
+    Bundles are walked once with Tarjan's algorithm, so bundles that
+    contain each other collapse into one group sharing a membership, and
+    each group's membership is built from its sub-bundles' already
+    computed ones. Cycles and missing sub-bundles are logged and returned"""
+    compiled = CompiledBundles()
+    by_name = {bundle.name: bundle for bundle in bundles}
+    cards_by_character = defaultdict(list)
+    for card in cards:
+        if card.character:
+            cards_by_character[card.character].append(card.name)
+
+    direct = {}
+    edges = {}
+    for bundle in bundles:
+        direct[bundle.name] = set(bundle.cards).union(
+            *(cards_by_character[character] for character in bundle.characters))
+        edges[bundle.name] = []
+        for sub_bundle in bundle.sub_bundles:
+            if sub_bundle in by_name:
+                edges[bundle.name].append(sub_bundle)
+            else:
+                logger.error(f'Bundle {bundle.name!r} includes {sub_bundle!r}, which is not a bundle')
+                compiled.missing.append((bundle.name, sub_bundle))
+
+    order = itertools.count()
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+
+    def close_group(name):
+        # name is the root of a group of bundles, everything they include
+        # outside the group has been resolved already
+        group = []
+        while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            group.append(member)
+            if member == name:
+                break
+        members = set()
+        for member in group:
+            members.update(direct[member])
+            for sub_bundle in edges[member]:
+                if sub_bundle not in group:
+                    members.update(compiled.members[sub_bundle])
+        for member in group:
+            compiled.members[member] = frozenset(members)
+        if len(group) > 1 or name in edges[name]:
+            logger.error(f'Bundles include each other: {", ".join(sorted(group))}')
+            compiled.cycles.append(sorted(group))
+
+    def visit(root):
+        # Depth first without recursion, deep chains of sub-bundles would
+        # otherwise hit the recursion limit
+        index[root] = lowlink[root] = next(order)
+        stack.append(root)
+        on_stack.add(root)
+        path = [(root, iter(edges[root]))]
+        while path:
+            name, sub_bundles = path[-1]
+            for sub_bundle in sub_bundles:
+                if sub_bundle not in index:
+                    index[sub_bundle] = lowlink[sub_bundle] = next(order)
+                    stack.append(sub_bundle)
+                    on_stack.add(sub_bundle)
+                    path.append((sub_bundle, iter(edges[sub_bundle])))
+                    break
+                if sub_bundle in on_stack:
+                    lowlink[name] = min(lowlink[name], index[sub_bundle])
+            else:
+                path.pop()
+                if path:
+                    parent = path[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    close_group(name)
+
+    for bundle in bundles:
+        if bundle.name not in index:
+            visit(bundle.name)
+
+    card_bundles = defaultdict(list)
+    for bundle in bundles:
+        for card_name in compiled.members[bundle.name]:
+            card_bundles[card_name].append(bundle.name)
+    compiled.card_bundles = {card_name: sorted(names) for card_name, names in sorted(card_bundles.items())}
+    return compiled
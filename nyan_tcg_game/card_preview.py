@@ -1,9 +1,14 @@
 import os
+import time
 import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
 from PIL import Image, ImageDraw
 
-from nyan_tcg_game.cards import Card
+from nyan_tcg_game.cards import Card, Rarity
+from nyan_tcg_game.build_manifest import card_key, file_stamp, hash_inputs
+from nyan_tcg_game import profiling
 logger = logging.getLogger(__name__)
 
 border_color = (255, 189, 123)
@@ -30,6 +35,93 @@ def inset_box(box, inset):
     x1, y1, x2, y2 = box
     return (x1 + inset, y1 + inset, x2 - inset, y2 - inset)
 
+def get_header_bbox(dim_w):
+    x1 = (dim_w - header_width) // 2
+    x2 = x1 + header_width
+    return (x1, header_ypos, x2, header_ypos + header_height)
+
+def draw_textbox(draw, bbox, text, font_size, box=True):
+    if box:
+        draw.rounded_rectangle(bbox,
+                               fill=textbox_color,
+                               radius=textbox_radius,
+                               width=textbox_border_width,
+                               outline=(0,0,0))
+    bbox_center = ((bbox[0] + bbox[2]) // 2, (bbox[1] + bbox[3]) // 2)
+    if text:
+        draw.text(bbox_center, text,
+                  fill="white", anchor="mm",
+                  stroke_fill="black",
+                  stroke_width=2,
+                  font_size=font_size)
+    return bbox_center
+
+
+# Everything on a preview except the card art and the name and company
+# text is the same for every card of a given rarity, so those layers are
+# drawn once per frame size and reused
+
+@functools.cache
+def frame_layers(dim_w, dim_h):
+    """Returns the card border, with the art window left transparent, and
+    the mask of the art window"""
+    frame = Image.new(mode="RGBA", size=(dim_w, dim_h), color=(0,0,0,0))
+    frame_draw = ImageDraw.Draw(frame)
+    border_outer_bbox = inset_box((0, 0, dim_w-1, dim_h-1), 1)
+
+    frame_draw.rounded_rectangle(border_outer_bbox,
+                                 fill=border_color,
+                                 radius=border_radius,
+                                 width=border_outline_width,
+                                 outline=(0, 0, 0))
+
+    border_inner_bbox = inset_box(border_outer_bbox, 28)
+    frame_draw.rounded_rectangle(border_inner_bbox,
+                                 fill=border_color,
+                                 radius=border_radius,
+                                 width=border_outline_width,
+                                 outline=(0, 0, 0))
+
+    mask = Image.new(mode="L", size=(dim_w, dim_h))
+    mask_draw = ImageDraw.Draw(mask)
+    mask_draw.rounded_rectangle(inset_box(border_inner_bbox, border_outline_width),
+                                fill=255,
+                                radius=border_radius-border_outline_width-1)
+    # Anything in the art window the card image does not cover ends up
+    # transparent
+    frame.paste((0, 0, 0, 0), mask=mask)
+    return frame, mask
+
+@functools.cache
+def badge_layer(dim_w, dim_h, rarity: Rarity):
+    """Returns the text boxes drawn over the art, including the rarity
+    badge for the given rarity, cropped to their bounding box along with
+    the position to composite them at"""
+    layer = Image.new(mode="RGBA", size=(dim_w, dim_h), color=(0,0,0,0))
+    layer_draw = ImageDraw.Draw(layer)
+    draw_textbox(layer_draw, get_header_bbox(dim_w), None, 0)
+    draw_textbox(layer_draw, company_bbox, None, 0)
+    bbox_center = draw_textbox(layer_draw, rarity_bbox, None, 0)
+
+    print_center = (bbox_center[0] - 30, bbox_center[1])
+
+    layer_draw.text(print_center, "1",
+                    fill=textbox_color, anchor="mm",
+                    stroke_fill="black",
+                    stroke_width=2,
+                    font_size=35)
+
+    rarity_center = (bbox_center[0] + 48, bbox_center[1])
+    layer_draw.text(rarity_center, rarity.short_name,
+                    fill="gold", anchor="mm",
+                    stroke_fill="black",
+                    stroke_width=2,
+                    font_size=35)
+
+    layer_draw.line((526, 680, 526, 722), fill="black", width=2)
+    bbox = layer.getbbox()
+    return bbox[:2], layer.crop(bbox)
+
 
 class CardFrame:
     def __init__(self, card, image_directory):
@@ -37,9 +129,9 @@ class CardFrame:
         self.load_image(image_directory)
         # Do the actual preview generation
         self.create_preview_frame(600, 800)
+        self.draw_rarity()
         self.draw_header()
         self.draw_company()
-        self.draw_rarity()
 
 
     def load_image(self, image_directory):
@@ -50,81 +142,26 @@ class CardFrame:
 
     def create_preview_frame(self, dim_w, dim_h):
         """Creates the card preview image, loads the card's cropped image into the preview"""
-        self.preview = Image.new(mode="RGBA", size=(dim_w, dim_h), color=(0,0,0,0))
+        frame, mask = frame_layers(dim_w, dim_h)
+        self.preview = frame.copy()
         self.preview_draw = ImageDraw.Draw(self.preview)
-        border_outer_bbox = inset_box((0, 0, dim_w-1, dim_h-1), 1)
-
-        self.preview_draw.rounded_rectangle(border_outer_bbox,
-                                            fill=border_color,
-                                            radius=border_radius,
-                                            width=border_outline_width,
-                                            outline=(0, 0, 0))
-
-        border_inner_bbox = inset_box(border_outer_bbox, 28)
-        self.preview_draw.rounded_rectangle(border_inner_bbox,
-                                            fill=border_color,
-                                            radius=border_radius,
-                                            width=border_outline_width,
-                                            outline=(0, 0, 0))
-
-        mask = Image.new(mode="RGBA", size=(dim_w, dim_h))
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.rounded_rectangle(inset_box(border_inner_bbox, border_outline_width),
-                                    fill=(255, 255, 255, 255),
-                                    radius=border_radius-border_outline_width-1)
-        
 
         card_w, card_h = self.card_image.size
         offset = ((dim_w - card_w) // 2, (dim_h - card_h) // 2)
-        overlay = Image.new(mode="RGBA", size=(dim_w, dim_h))
-        overlay.paste(self.card_image, offset)
-        self.preview.paste(overlay, mask=mask)
-
-    def draw_textbox(self, bbox, text, font_size):
-        self.preview_draw.rounded_rectangle(bbox,
-                                            fill=textbox_color,
-                                            radius=textbox_radius,
-                                            width=textbox_border_width,
-                                            outline=(0,0,0))
-        bbox_center = ((bbox[0] + bbox[2]) // 2, (bbox[1] + bbox[3]) // 2)
-        if text:
-            self.preview_draw.text(bbox_center, text,
-                                fill="white", anchor="mm",
-                                stroke_fill="black",
-                                stroke_width=2,
-                                font_size=font_size)
-        return bbox_center
-        
+        card_mask = mask.crop((*offset, offset[0] + card_w, offset[1] + card_h))
+        self.preview.paste(self.card_image, offset, mask=card_mask)
 
     def draw_header(self):
         w, h = self.preview.size
-        x1 = (w - header_width) // 2
-        x2 = x1 + header_width
-        header_bbox = (x1, header_ypos, x2, header_ypos + header_height)
-        self.draw_textbox(header_bbox, self.card.card_name, 40)
+        draw_textbox(self.preview_draw, get_header_bbox(w), self.card.card_name, 40, box=False)
                                             
     def draw_company(self):
-        self.draw_textbox(company_bbox, self.card.company, 40)
+        draw_textbox(self.preview_draw, company_bbox, self.card.company, 40, box=False)
 
     def draw_rarity(self):
-        bbox_center = self.draw_textbox(rarity_bbox, None, 0)
-
-        print_center = (bbox_center[0] - 30, bbox_center[1])
-
-        self.preview_draw.text(print_center, "1",
-                            fill=textbox_color, anchor="mm",
-                            stroke_fill="black",
-                            stroke_width=2,
-                            font_size=35)
-
-        rarity_center = (bbox_center[0] + 48, bbox_center[1])
-        self.preview_draw.text(rarity_center, self.card.rarity.short_name,
-                            fill="gold", anchor="mm",
-                            stroke_fill="black",
-                            stroke_width=2,
-                            font_size=35)
-
-        self.preview_draw.line((526, 680, 526, 722), fill="black", width=2)
+        """Composites the cached text boxes and rarity badge over the art"""
+        dest, layer = badge_layer(*self.preview.size, self.card.rarity)
+        self.preview.alpha_composite(layer, dest)
 
 
     def create_frame(self, width):
@@ -139,11 +176,59 @@ class CardFrame:
         
 
 
-def generate_previews(cards: list[Card], image_directory: str, output_directory: str):
+def preview_inputs(card: Card, image_directory: str):
+    # Only what is drawn, so a card rebuilt from an exported pack matches
+    # the one parsed from the sheet
+    return hash_inputs(card.card_name, card.company, card.rarity,
+                       file_stamp(os.path.join(image_directory, card.resized_uri)))
+
+def render_preview(card: Card, image_directory: str, output_directory: str):
+    """Renders and saves a single card's preview, run in a worker process"""
+    frame = CardFrame(card, image_directory)
+    frame.save_preview(output_directory)
+    return os.path.join(output_directory, card.get_image_filename('.png'))
+
+def generate_previews(cards: list[Card], image_directory: str, output_directory: str, manifest=None,
+                      workers=None):
+    """Renders a preview for each card across a pool of worker processes.
+    Progress is reported in card order, and a card that fails to render
+    is logged and skipped without affecting the others. With a build
+    manifest, previews whose card data and cropped image are unchanged
+    are skipped and failed previews are recorded so they are retried.
+    Returns the cards whose preview failed"""
     os.makedirs(output_directory, exist_ok=True)
+    jobs = []
     for card in cards:
-        frame = CardFrame(card, image_directory)
-
-        frame.save_preview(output_directory)
-
-
+        preview_filename = os.path.join(output_directory, card.get_image_filename('.png'))
+        name = f'preview/{card_key(card)}'
+        inputs = preview_inputs(card, image_directory)
+        if manifest and manifest.is_current(name, inputs, preview_filename):
+            logger.debug(f'Skipping unchanged preview {preview_filename}')
+            continue
+        jobs.append((card, name, inputs))
+
+    failed = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [profiling.submit(executor, card.card_name, 'preview', render_preview, card, image_directory,
+                                    output_directory)
+                   for card, _, _ in jobs]
+        for index, ((card, name, inputs), future) in enumerate(zip(jobs, futures)):
+            try:
+                preview_filename = future.result()
+            except Exception as e:
+                logger.error(f'Failed to render the preview of {card.card_name}: {e}')
+                failed.append(card)
+                if manifest:
+                    manifest.record_failure(name, e)
+                continue
+            logger.info(f'[{index + 1}/{len(jobs)}] Rendered {preview_filename}')
+            profiling.add_written(preview_filename)
+            if manifest:
+                manifest.record(name, inputs, preview_filename)
+
+    if jobs:
+        elapsed = time.perf_counter() - start
+        logger.info(f'Rendered {len(jobs) - len(failed)} previews ({len(failed)} failed) in {elapsed:.1f}s, '
+                    f'{len(jobs) / elapsed:.1f} cards/s')
+    return failed
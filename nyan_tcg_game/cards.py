@@ -2,7 +2,6 @@ from dataclasses import dataclass
 from enum import Enum
 import re
 import logging
-from PIL import ImageColor
 
 invalid_character_selector = re.compile(r'[()\'\"\[\]\{\}]')
 
@@ -21,7 +20,12 @@ class Rarity(str, Enum):
             return "R"
         return "SR"
 
-@dataclass
+class BundleType(str, Enum):
+    CHARACTER = 'character'
+    CARD = 'card'
+    BUNDLE = 'bundle'
+
+@dataclass(slots=True)
 class Card:
     name: str
     variant: str | None
@@ -34,6 +38,9 @@ class Card:
     local_image_path: str | None # Once an image has been fetched from the image file URI, its path is stored here
     resized_uri: str | None # Stores the image path after it has been resized
     background_fill: str # For transparent images, stores the background color to fill with
+    source_image_hash: str | None = None # sha256 of the image fetched from the image file URI
+    export_uri: str | None = None # Stores the path of the encoded image published in the pack, if any
+    thumbnails: list | None = None # Stores (width, height, path) of each thumbnail of the image
 
 
     @property
@@ -41,10 +48,15 @@ class Card:
         return f'{self.name} ({self.variant})' if self.variant else self.name
 
     def get_image_filename(self, suffix) -> str:
-        filename = f'{self.name}_{self.variant}' if self.variant else self.name
-        cleaned_name = invalid_character_selector.sub('', filename)
-        cleaned_name = cleaned_name.replace(' ', '_').lower()
-        return cleaned_name + suffix
+        return image_filename(self.name, self.variant, suffix)
+
+def image_filename(name, variant, suffix) -> str:
+    """The filename of a card's images. Brackets and quotes are dropped,
+    so different names can end up with the same filename"""
+    filename = f'{name}_{variant}' if variant else name
+    cleaned_name = invalid_character_selector.sub('', filename)
+    cleaned_name = cleaned_name.replace(' ', '_').lower()
+    return cleaned_name + suffix
 
 def dict_to_card(data):
     if not data['Rarity']:
@@ -1,17 +1,21 @@
 import tkinter as tk
 import logging
+import time
 from tkinter import filedialog, messagebox, colorchooser
 from PIL import Image, ImageTk, ImageColor
 import os
 
+from nyan_tcg_game.crop_recipes import (VISIBLE_SIZE, CropRecipe, CropWriter, find_crops_needed,
+                                        get_crop_bbox_from_view_bbox, update_crop_status)
+from nyan_tcg_game.build_manifest import card_key
+from nyan_tcg_game.image_files import CardFeed
+from nyan_tcg_game import profiling
+from nyan_tcg_game.image_proxy import (ImagePrefetcher, DEFAULT_PREFETCH_AHEAD,
+                                       DEFAULT_PREFETCH_MAX_SIZE_MB)
+
 logger = logging.getLogger(__name__)
 
-# The images fed into nyan's tcg bot are required to be exactly
-# 550x750 pixels However, the actual viewable area is slightly
-# less. The card frame cuts off 8 pixels on each side of the image,
-# leaving an area of 534x734. Finally, the card's nameplate cuts off
-# an additional 46 pixels from the top of the image, yielding a final
-# viewable area of 534x688 pixels
+# The output and visible area sizes are defined in crop_recipes
 
 # This script allows the user to easily crop the image to the correct
 # dimensions. The user is presented with a rectangle indicating the
@@ -21,16 +25,31 @@ logger = logging.getLogger(__name__)
 # is positioned in the correct area on the card
 
 
-OUTPUT_SIZE = (550, 750)  # target size after crop/resize
-VISIBLE_SIZE = (534, 688)
-VISIBLE_RECT_OFFSETS = (-8, -54, 8, 8)
 OUTPUT_DIR = "cropped_output"
+# Tk sends a stream of <Configure> events while the window is being
+# resized, only redraw once they have stopped for this long
+RESIZE_DEBOUNCE_MS = 100
+# How often finished background writes are picked up
+WRITE_POLL_MS = 200
+# How often cards that have finished downloading are picked up
+FEED_POLL_MS = 250
 
 class CropTool:
-    def __init__(self, root, cards, output_directory):
+    def __init__(self, root, cards, output_directory, manifest=None, recipes=None,
+                 prefetch=DEFAULT_PREFETCH_AHEAD, prefetch_max_bytes=DEFAULT_PREFETCH_MAX_SIZE_MB * 1024 * 1024,
+                 suggestions=None, feed=None, select=None):
         self.root = root
         self.cards = cards
         self.output_directory = output_directory
+        self.manifest = manifest
+        self.recipes = recipes
+        # Visible areas in source pixels to start each card with, by card_key
+        self.suggestions = suggestions or {}
+        # Cards still downloading arrive through feed, select picks the
+        # ones that need cropping
+        self.feed = feed
+        self.select = select
+        self.waiting = False
         self.current_index = 0
         self.start_x = self.start_y = None
         self.rect = None
@@ -48,24 +67,41 @@ class CropTool:
         btn_frame.pack(fill="x", pady=5)
         tk.Button(btn_frame, text="Crop & Next", command=self.crop_and_next).pack(side="left", padx=5)
         tk.Button(btn_frame, text="Skip", command=self.next_image).pack(side="left", padx=5)
-        tk.Button(btn_frame, text="Quit", command=root.quit).pack(side="right", padx=5)
+        tk.Button(btn_frame, text="Quit", command=self.quit).pack(side="right", padx=5)
         self.color_input = tk.Text(btn_frame, height=1, width=10)
         self.color_input.pack(side="right", padx=5)
         self.color_input.bind("<<Modified>>", self.on_color_update)
         tk.Button(btn_frame, text="Pick Color", command=self.pick_color).pack(side="right", padx=5)
 
         # --- Image handling ---
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
         self.root.bind("<Configure>", self.on_resize)
         self.canvas.bind("<ButtonPress-1>", self.on_press)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
 
-        self.img = None
+        # Images are decoded ahead of time, no larger than the screen
+        display_size = (root.winfo_screenwidth(), root.winfo_screenheight())
+        self.prefetcher = ImagePrefetcher(cards, display_size, prefetch, prefetch_max_bytes)
+        # Crops are rendered and saved in the background
+        self.writer = CropWriter()
+        self.root.after(WRITE_POLL_MS, self.poll_writes)
+        if self.feed:
+            self.root.after(FEED_POLL_MS, self.poll_feed)
+        self.pyramid = None
         self.tk_img = None
         self.display_img = None
+        self.resize_job = None
+        self.canvas_size = None
         self.load_image()
 
     def load_image(self):
+        if self.current_index >= len(self.cards):
+            # A failed write queues its card again
+            self.finish_writes(self.writer.flush())
+        if self.current_index >= len(self.cards) and self.feed and not self.feed.exhausted:
+            self.wait_for_downloads()
+            return
         if self.current_index >= len(self.cards):
             messagebox.showinfo("Done", "All images processed!")
             self.root.quit()
@@ -73,24 +109,32 @@ class CropTool:
         card = self.cards[self.current_index]
         logger.debug(f"Loading {card=}")
 
-        path = card.local_image_path
-        top_img = Image.open(path).convert("RGBA")
-        bottom_img = Image.new(mode="RGBA", size=top_img.size, color=card.background_fill)
-        self.img = Image.alpha_composite(bottom_img, top_img)
-        #self.img.paste(top_img, (0, 0), top_img)
+        # The display works from a reduced decode, the full resolution
+        # image is only read when the crop is saved
+        try:
+            self.pyramid = self.prefetcher.get(self.current_index)
+        except Exception as e:
+            logger.error(f"Could not open {card.local_image_path} for {card.card_name}: {e}")
+            self.next_image()
+            return
 
-        self.root.title(f"Cropping ({self.current_index+1}/{len(self.cards)}): {os.path.basename(path)}")
+        downloading = '+' if self.feed and not self.feed.exhausted else ''
+        self.root.title(f"Cropping ({self.current_index+1}/{len(self.cards)}{downloading}): {card.card_name}")
+        self.shown_at = time.perf_counter_ns()
         self.display_image()
+        if card_key(card) in self.suggestions:
+            self.show_suggestion(self.suggestions[card_key(card)])
 
     def display_image(self):
-        if not self.img:
+        if not self.pyramid:
             return
 
         self.canvas.delete("all")
         cw = max(self.canvas.winfo_width(), 800)
         ch = max(self.canvas.winfo_height(), 600)
+        self.canvas_size = (cw, ch)
 
-        iw, ih = self.img.size
+        iw, ih = self.pyramid.full_size
 
         scale = min(cw/iw, ch/ih)
         self.scale = scale
@@ -98,7 +142,8 @@ class CropTool:
 
         offsetx, offsety = ((cw - new_w) // 2, 0)
 
-        self.display_img = self.img.resize((new_w, new_h), Image.LANCZOS)
+        background_fill = self.cards[self.current_index].background_fill
+        self.display_img = self.pyramid.render((new_w, new_h), background_fill)
         self.tk_img = ImageTk.PhotoImage(self.display_img)
         self.canvas.create_image(offsetx, offsety, anchor="nw", image=self.tk_img)
         self.canvas.image = self.tk_img
@@ -113,7 +158,7 @@ class CropTool:
                 color = ImageColor.getrgb(color_str)
                 logger.debug(f"Setting color to {color}")
                 self.cards[self.current_index].background_fill = color
-                self.load_image()
+                self.display_image()
             except:
                 pass
 
@@ -121,7 +166,26 @@ class CropTool:
 
 
     def on_resize(self, event):
-        self.display_image()
+        if self.resize_job:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_DEBOUNCE_MS, self.on_resize_settled)
+
+    def on_resize_settled(self):
+        self.resize_job = None
+        size = (max(self.canvas.winfo_width(), 800), max(self.canvas.winfo_height(), 600))
+        if size != self.canvas_size:
+            self.display_image()
+
+    def show_suggestion(self, view_bbox):
+        """Draws a visible area given in source pixels as if it had been
+        dragged out, so Crop & Next accepts it as is"""
+        ow, oh = self.coord_offset
+        x1, y1, x2, y2 = (c * self.scale for c in view_bbox)
+        self.rect = self.canvas.create_rectangle(x1 + ow, y1 + oh, x2 + ow, y2 + oh, outline="blue", width=2)
+        crop_coords = self.get_crop_bbox_from_view_bbox((x1, y1, x2, y2))
+        self.crop_rect = self.canvas.create_rectangle(*(c + o for c, o in zip(crop_coords, (ow, oh, ow, oh))),
+                                                      outline="red", width=2)
+        self.crop_coords = crop_coords
 
     def on_press(self, event):
         self.start_x, self.start_y = event.x, event.y
@@ -170,19 +234,66 @@ class CropTool:
             messagebox.showwarning("No selection", "Please draw a crop rectangle first.")
             return
 
-        x1, y1, x2, y2 = coords = [int(c / self.scale) for c in self.crop_coords]
+        bbox = tuple(int(c / self.scale) for c in self.crop_coords)
 
-        cropped = self.img.crop((x1, y1, x2, y2)).resize(OUTPUT_SIZE, Image.LANCZOS)
+        card = self.cards[self.current_index]
+        recipe = CropRecipe(card.source_image_hash, bbox, tuple(card.background_fill))
 
-        filename = self.cards[self.current_index].get_image_filename('.png')
+        filename = card.get_image_filename('.png')
         save_path = os.path.join(self.output_directory, filename)
         logger.debug(f'{save_path=} {filename=}')
-        cropped.save(save_path)
-        print(f"Saved: {save_path}")
+        # How long the card was on screen before it was cropped
+        profiling.add_span(card.card_name, 'crop choice', self.shown_at, time.perf_counter_ns())
+        self.writer.submit(card, recipe, card.local_image_path, save_path)
 
         self.next_image()
 
+    def wait_for_downloads(self):
+        self.waiting = True
+        self.pyramid = None
+        self.crop_coords = None
+        self.canvas.delete("all")
+        self.root.title(f"Cropping ({len(self.cards)} done): waiting for downloads...")
+
+    def poll_feed(self):
+        self.cards.extend(self.select(self.feed.poll()))
+        if self.waiting and (self.current_index < len(self.cards) or self.feed.exhausted):
+            self.waiting = False
+            self.load_image()
+        if not self.feed.exhausted:
+            self.root.after(FEED_POLL_MS, self.poll_feed)
+
+    def poll_writes(self):
+        self.finish_writes(self.writer.drain())
+        self.root.after(WRITE_POLL_MS, self.poll_writes)
+
+    def finish_writes(self, results):
+        for result in results:
+            card = result.card
+            if result.error:
+                logger.error(f"Failed to save {result.filename}: {result.error}")
+                messagebox.showerror("Save failed", f"Could not save the crop of {card.card_name}:\n"
+                                     f"{result.error}\n\nIt has been queued to crop again.")
+                self.cards.append(card)
+                continue
+            print(f"Saved: {result.filename}")
+            profiling.add_written(result.filename)
+            if self.recipes:
+                self.recipes.set(card, result.recipe)
+            if self.manifest:
+                self.manifest.record_crop(card, result.filename)
+
+    def quit(self):
+        self.finish_writes(self.writer.flush())
+        self.root.quit()
+
+    def close(self):
+        self.writer.close()
+        self.prefetcher.close()
+
     def next_image(self):
+        if self.waiting:
+            return
         self.current_index += 1
         self.crop_coords = None
         self.load_image()
@@ -194,27 +305,50 @@ class CropTool:
         self.color_input.replace("1.0", "end-1c", ret[1])
 
     def get_crop_bbox_from_view_bbox(self, view_bbox):
-        x1, y1, x2, y2 = view_bbox
-        w = x2-x1
-        scale = w / VISIBLE_SIZE[0]
-        return tuple(map(lambda x, y: x + y*scale, view_bbox, VISIBLE_RECT_OFFSETS))
+        return get_crop_bbox_from_view_bbox(view_bbox)
         
     
 
-def run_gui(cards, output_directory):
+def run_gui(cards, output_directory, manifest=None, recipes=None, prefetch=DEFAULT_PREFETCH_AHEAD,
+            prefetch_max_bytes=DEFAULT_PREFETCH_MAX_SIZE_MB * 1024 * 1024, suggestions=None, feed=None,
+            select=None):
     if not cards:
         return
     root = tk.Tk()
-    app = CropTool(root, cards, output_directory)
+    app = CropTool(root, cards, output_directory, manifest, recipes, prefetch, prefetch_max_bytes, suggestions,
+                   feed, select)
     root.mainloop()
-
-def crop_images(cards, output_directory, export_prefix):
+    app.close()
+    root.destroy()
+    if recipes:
+        recipes.save()
+
+def crop_images(cards, output_directory, export_prefix, manifest=None, recipes=None,
+                prefetch=DEFAULT_PREFETCH_AHEAD, prefetch_max_bytes=DEFAULT_PREFETCH_MAX_SIZE_MB * 1024 * 1024):
+    """Opens the crop GUI for every card without a cropped image. With a
+    build manifest, crops made from a different source image than the
+    card now has are reported as stale and queued for rework too.
+
+    cards can be a CardFeed of cards still downloading, the GUI then opens
+    as soon as the first card that needs cropping arrives and picks up the
+    rest as they come in"""
     logger.debug(output_directory)
+    feed = cards if isinstance(cards, CardFeed) else CardFeed(cards)
+
+    def select(arrived):
+        return find_crops_needed(arrived, output_directory, export_prefix, manifest)[0]
+
+    # Only open a window once there is something to crop
     resize_needed = []
-    for card in cards:
-        filename = os.path.join(output_directory, card.get_image_filename('.png'))
-        card.resized_uri = os.path.relpath(filename, export_prefix)
-        if not os.path.exists(filename):
-            resize_needed.append(card)
-    run_gui(resize_needed, output_directory)
+    while not resize_needed and not feed.exhausted:
+        resize_needed = select(feed.poll(timeout=FEED_POLL_MS / 1000))
+    run_gui(resize_needed, output_directory, manifest, recipes, prefetch, prefetch_max_bytes,
+            feed=feed, select=select)
+    # If the GUI was quit early the rest of the downloads still need to
+    # finish and be pointed at their crops
+    select(list(feed))
+    cards = feed.result()
+
+    if manifest:
+        update_crop_status(cards, export_prefix, manifest)
     return cards
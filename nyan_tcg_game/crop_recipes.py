@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, asdict
+
+from PIL import Image
+
+from nyan_tcg_game.build_manifest import card_key
+from nyan_tcg_game.downloader import open_atomic, write_atomic
+from nyan_tcg_game import profiling
+
+logger = logging.getLogger(__name__)
+
+# The images fed into nyan's tcg bot are required to be exactly
+# 550x750 pixels However, the actual viewable area is slightly
+# less. The card frame cuts off 8 pixels on each side of the image,
+# leaving an area of 534x734. Finally, the card's nameplate cuts off
+# an additional 46 pixels from the top of the image, yielding a final
+# viewable area of 534x688 pixels
+
+OUTPUT_SIZE = (550, 750)  # target size after crop/resize
+VISIBLE_SIZE = (534, 688)
+VISIBLE_RECT_OFFSETS = (-8, -54, 8, 8)
+RESAMPLE = Image.LANCZOS
+
+RECIPES_FILE = 'crop_recipes.json'
+
+DEFAULT_WRITE_WORKERS = 2
+DEFAULT_MAX_PENDING_WRITES = 8
+
+
+@dataclass
+class CropRecipe:
+    """Everything needed to rebuild a cropped card image from its source:
+    the source image's hash, the crop box in source pixel coordinates and
+    the background fill composited under transparent images"""
+    source_hash: str | None
+    bbox: tuple[int, int, int, int]
+    background_fill: tuple
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(source_hash=data['source_hash'],
+                   bbox=tuple(data['bbox']),
+                   background_fill=tuple(data['background_fill']))
+
+
+def get_crop_bbox_from_view_bbox(view_bbox):
+    """Expands the visible area of a card to the full area it is cropped to"""
+    x1, y1, x2, y2 = view_bbox
+    w = x2-x1
+    scale = w / VISIBLE_SIZE[0]
+    return tuple(map(lambda x, y: x + y*scale, view_bbox, VISIBLE_RECT_OFFSETS))
+
+def composite_background(image, background_fill):
+    top_img = image.convert("RGBA")
+    bottom_img = Image.new(mode="RGBA", size=top_img.size, color=background_fill)
+    return Image.alpha_composite(bottom_img, top_img)
+
+def crop_to_output(image, bbox):
+    return image.crop(bbox).resize(OUTPUT_SIZE, RESAMPLE)
+
+def render_recipe(recipe: CropRecipe, source_path):
+    with Image.open(source_path) as source:
+        return crop_to_output(composite_background(source, recipe.background_fill), recipe.bbox)
+
+
+class RecipeStore:
+    """The crop recipe of every card in an export, stored as JSON in the
+    export directory and keyed like the card's image filename"""
+    def __init__(self, export_dir):
+        self.filename = os.path.join(export_dir, RECIPES_FILE)
+        self.recipes = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                self.recipes = {key: CropRecipe.from_dict(recipe) for key, recipe in json.load(f).items()}
+
+    def get(self, card) -> CropRecipe | None:
+        return self.recipes.get(card_key(card))
+
+    def set(self, card, recipe: CropRecipe):
+        self.recipes[card_key(card)] = recipe
+
+    def save(self):
+        data = {key: asdict(recipe) for key, recipe in sorted(self.recipes.items())}
+        write_atomic(self.filename, json.dumps(data, indent=2).encode('utf-8'))
+
+
+def save_crop(recipe, source_path, output_path):
+    """Renders recipe and writes it to output_path, which is only replaced
+    once the whole image has been encoded"""
+    image = render_recipe(recipe, source_path)
+    with open_atomic(output_path) as f:
+        image.save(f, format=os.path.splitext(output_path)[1][1:])
+    return output_path
+
+
+@dataclass
+class WriteResult:
+    card: object
+    recipe: CropRecipe
+    filename: str
+    error: Exception | None = None
+
+
+class CropWriter:
+    """Renders and saves crops on background threads so the crop GUI can
+    move on as soon as a crop is chosen.
+
+    At most max_pending crops are queued or being written at once, submit
+    blocks until one finishes beyond that. Finished writes are collected
+    with drain on the caller's thread, so the manifest and recipes are only
+    ever touched from there"""
+    def __init__(self, workers=DEFAULT_WRITE_WORKERS, max_pending=DEFAULT_MAX_PENDING_WRITES):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='crop-writer')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.finished = queue.SimpleQueue()
+        self.futures = set()
+
+    def submit(self, card, recipe, source_path, filename):
+        self.slots.acquire()
+        self.futures.add(self.executor.submit(self._write, card, recipe, source_path, filename))
+
+    def _write(self, card, recipe, source_path, filename):
+        # The result is queued before the future completes, so flush
+        # always sees it
+        result = WriteResult(card, recipe, filename)
+        try:
+            with profiling.span(card.card_name, 'crop save'):
+                save_crop(recipe, source_path, filename)
+        except Exception as e:
+            result.error = e
+        self.finished.put(result)
+        self.slots.release()
+
+    def drain(self) -> list[WriteResult]:
+        """Returns the writes that have finished since the last drain"""
+        results = []
+        while not self.finished.empty():
+            results.append(self.finished.get())
+        self.futures = {future for future in self.futures if not future.done()}
+        return results
+
+    def flush(self) -> list[WriteResult]:
+        """Waits for every pending write, then drains them"""
+        wait(self.futures)
+        return self.drain()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def find_crops_needed(cards, output_directory, export_prefix, manifest=None):
+    """Points every card's resized_uri at its cropped image and returns
+    (needed, stale): the cards without a crop plus, with a build manifest,
+    those whose crop was made from a different source image than the card
+    now has. Stale cards are included in needed"""
+    needed = []
+    stale = []
+    for card in cards:
+        filename = os.path.join(output_directory, card.get_image_filename('.png'))
+        card.resized_uri = os.path.relpath(filename, export_prefix)
+        if not os.path.exists(filename):
+            needed.append(card)
+        elif manifest and manifest.crop_is_stale(card, filename):
+            stale.append(card)
+            needed.append(card)
+    if stale:
+        logger.warning(f'{len(stale)} crops were made from an image that has since changed and need rework: '
+                       + ', '.join(card.card_name for card in stale))
+    return needed, stale
+
+def update_crop_status(cards, export_prefix, manifest):
+    """Records which cards still have a stale or missing crop"""
+    def crop_filename(card):
+        return os.path.join(export_prefix, card.resized_uri)
+    stale = [card for card in cards
+             if os.path.exists(crop_filename(card)) and manifest.crop_is_stale(card, crop_filename(card))]
+    missing = [card for card in cards if not os.path.exists(crop_filename(card))]
+    if stale or missing:
+        logger.warning(f'{len(stale)} stale and {len(missing)} missing crops remain')
+    manifest.set_crop_status(stale, missing)
+
+
+def rerender_crops(cards, output_directory, export_prefix, recipes: RecipeStore, image_cache,
+                   workers=None, manifest=None):
+    """Rebuilds every cropped image that has a recipe from its source
+    image, spread across a process pool. Cards without a recipe, or whose
+    recipe's source image is no longer cached, are left untouched"""
+    os.makedirs(output_directory, exist_ok=True)
+    cards = list(cards)
+    jobs = []
+    for card in cards:
+        filename = os.path.join(output_directory, card.get_image_filename('.png'))
+        card.resized_uri = os.path.relpath(filename, export_prefix)
+        recipe = recipes.get(card)
+        if recipe is None:
+            logger.warning(f'No crop recipe for {card.card_name}, it must be cropped in the GUI')
+            continue
+        source_path = image_cache.lookup_hash(recipe.source_hash) if recipe.source_hash else None
+        if source_path is None:
+            logger.warning(f'Source image of the crop recipe for {card.card_name} is no longer cached')
+            continue
+        if recipe.source_hash != card.source_image_hash:
+            logger.warning(f'{card.card_name} now points at a different image than its crop recipe, '
+                           'rerendering from the recipe\'s image')
+        jobs.append((card, recipe, source_path, filename))
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [(card, recipe, profiling.submit(executor, card.card_name, 'crop', save_crop, recipe,
+                                                            source_path, filename))
+                   for card, recipe, source_path, filename in jobs]
+        for index, (card, recipe, future) in enumerate(futures):
+            try:
+                filename = future.result()
+            except Exception as e:
+                logger.error(f'Failed to rerender {card.card_name}: {e}')
+                continue
+            logger.info(f'[{index + 1}/{len(futures)}] Rerendered {filename}')
+            profiling.add_written(filename)
+            if manifest and recipe.source_hash == card.source_image_hash:
+                card.background_fill = recipe.background_fill
+                manifest.record_crop(card, filename)
+
+    if manifest:
+        update_crop_status(cards, export_prefix, manifest)
+    return cards
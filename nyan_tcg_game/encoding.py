@@ -0,0 +1,175 @@
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+
+from PIL import Image, ImageChops, ImageStat
+
+from nyan_tcg_game import profiling
+from nyan_tcg_game.build_manifest import card_key, file_stamp, hash_inputs
+from nyan_tcg_game.crop_recipes import OUTPUT_SIZE
+from nyan_tcg_game.downloader import format_bytes, open_atomic
+
+logger = logging.getLogger(__name__)
+
+# Encoded card images are written here, the crops in images/ are kept as
+# the lossless masters they are encoded from
+ENCODED_DIR = 'encoded_images'
+# Thumbnails of each size go in a directory of their own under here
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_RESAMPLE = Image.LANCZOS
+IMAGE_FORMATS = ('png', 'webp')
+# Palette quantisation is only kept if the result is at least this close
+# to the original, measured as PSNR in dB
+MIN_QUANTIZE_PSNR = 35.0
+
+
+@dataclass
+class EncodeSettings:
+    """How exported card images are encoded. quality only applies to WebP,
+    which is lossless when it is None. colors only applies to PNG, which
+    is palette quantised to that many colors when it does not lose too
+    much quality"""
+    format: str = 'png'
+    compress_level: int = 9
+    colors: int | None = None
+    quality: int | None = None
+
+    @property
+    def extension(self):
+        return f'.{self.format}'
+
+
+def psnr(image, other):
+    """Peak signal to noise ratio between two images of the same size"""
+    stat = ImageStat.Stat(ImageChops.difference(image.convert('RGBA'), other.convert('RGBA')))
+    mse = sum(rms ** 2 for rms in stat.rms) / len(stat.rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def encode_image(image, settings: EncodeSettings, f):
+    if settings.format == 'webp':
+        if settings.quality is None:
+            image.save(f, format='WEBP', lossless=True, method=6)
+        else:
+            image.save(f, format='WEBP', quality=settings.quality, method=6)
+        return
+    if settings.colors:
+        quantized = image.convert('RGBA').quantize(settings.colors, method=Image.Quantize.FASTOCTREE)
+        if psnr(image, quantized) >= MIN_QUANTIZE_PSNR:
+            image = quantized
+    # Pillow's optimize always compresses at level 9, so it is only asked
+    # for when that is the level wanted
+    image.save(f, format='PNG', optimize=settings.compress_level == 9, compress_level=settings.compress_level)
+
+def thumbnail_size(width):
+    """The size of a thumbnail of the given width, keeping the card's aspect"""
+    return width, round(width * OUTPUT_SIZE[1] / OUTPUT_SIZE[0])
+
+def encode_file(source, destination, settings: EncodeSettings | None, thumbnails=()):
+    """Encodes source into destination and into each (size, filename) of
+    thumbnails, decoding source only once. Without settings only the
+    thumbnails are written, as plain optimized PNGs. Returns the size in
+    bytes of source and of each file written"""
+    written = []
+    with Image.open(source) as image:
+        image.load()
+        if settings:
+            with open_atomic(destination) as f:
+                encode_image(image, settings, f)
+            written.append(destination)
+        for size, filename in thumbnails:
+            with open_atomic(filename) as f:
+                encode_image(image.resize(size, THUMBNAIL_RESAMPLE), settings or EncodeSettings(), f)
+            written.append(filename)
+    return os.path.getsize(source), [os.path.getsize(filename) for filename in written]
+
+def point_at_encoded(card, export_dir, destination, thumbnails):
+    """Points the card at its encoded image, if there is one, and its
+    thumbnails. Only called once they have been written"""
+    if destination:
+        card.export_uri = os.path.relpath(destination, export_dir)
+    card.thumbnails = [(width, height, os.path.relpath(filename, export_dir))
+                       for (width, height), filename in thumbnails]
+
+
+def encode_images(cards, export_dir, settings: EncodeSettings | None, thumbnail_widths=(), workers=None,
+                  manifest=None):
+    """Encodes every card's cropped image in the given format and renders
+    its thumbnails in one pass across a process pool. Each card's
+    export_uri is pointed at the encoded image and its thumbnails at the
+    thumbnails written, cards that could not be encoded are left on their
+    crop. Cards whose crop and settings are unchanged are not encoded
+    again"""
+    extension = settings.extension if settings else '.png'
+    sizes = [thumbnail_size(width) for width in sorted(set(thumbnail_widths))]
+    if settings:
+        os.makedirs(os.path.join(export_dir, ENCODED_DIR), exist_ok=True)
+    for width, height in sizes:
+        os.makedirs(os.path.join(export_dir, THUMBNAIL_DIR, f'{width}x{height}'), exist_ok=True)
+    jobs = []
+    for card in cards:
+        source = os.path.join(export_dir, card.resized_uri)
+        destination = os.path.join(export_dir, ENCODED_DIR, card.get_image_filename(extension))
+        thumbnails = [((width, height), os.path.join(export_dir, THUMBNAIL_DIR, f'{width}x{height}',
+                                                     card.get_image_filename(extension)))
+                      for width, height in sizes]
+        if not settings:
+            destination = None
+        name = f'encode/{card_key(card)}'
+        if not os.path.exists(source):
+            if manifest:
+                manifest.record_failure(name, f'{card.resized_uri} does not exist')
+            continue
+        inputs = hash_inputs(file_stamp(source), settings and asdict(settings), sizes)
+        outputs = ([destination] if settings else []) + [filename for _, filename in thumbnails]
+        if manifest and all(manifest.is_current(f'{name}/{index}', inputs, filename)
+                            for index, filename in enumerate(outputs)):
+            point_at_encoded(card, export_dir, destination, thumbnails)
+            continue
+        jobs.append((card, name, inputs, source, destination, thumbnails, outputs))
+
+    before = after = thumbnail_bytes = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [profiling.submit(executor, card.card_name, 'encode', encode_file, source, destination, settings,
+                                    thumbnails)
+                   for card, _, _, source, destination, thumbnails, _ in jobs]
+        for index, (job, future) in enumerate(zip(jobs, futures)):
+            card, name, inputs, _, destination, thumbnails, outputs = job
+            try:
+                source_size, sizes_written = future.result()
+            except Exception as e:
+                logger.error(f'Failed to encode the image of {card.card_name}: {e}')
+                if manifest:
+                    manifest.record_failure(name, e)
+                continue
+            message = f'[{index + 1}/{len(jobs)}] Encoded {card.card_name}'
+            if settings:
+                encoded_size = sizes_written.pop(0)
+                before += source_size
+                after += encoded_size
+                message += (f': {format_bytes(source_size)} -> {format_bytes(encoded_size)} '
+                            f'({encoded_size / source_size - 1:+.0%})')
+            if sizes_written:
+                thumbnail_bytes += sum(sizes_written)
+                message += f', {len(sizes_written)} thumbnails {format_bytes(sum(sizes_written))}'
+            logger.info(message)
+            for filename in outputs:
+                profiling.add_written(filename)
+            point_at_encoded(card, export_dir, destination, thumbnails)
+            if manifest:
+                for output_index, filename in enumerate(outputs):
+                    manifest.record(f'{name}/{output_index}', inputs, filename)
+
+    if jobs:
+        elapsed = time.perf_counter() - start
+        message = f'Encoded {len(jobs)} images as {extension[1:]} in {elapsed:.1f}s'
+        if settings:
+            message += (f': {format_bytes(before)} -> {format_bytes(after)}'
+                        + (f' ({after / before - 1:+.0%})' if before else ''))
+        if sizes:
+            message += f', thumbnails {format_bytes(thumbnail_bytes)}'
+        logger.info(message)
+    return cards
@@ -0,0 +1,177 @@
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.sqlite3'
+BLOB_DIR = 'blobs'
+INCOMING_DIR = 'incoming'
+
+DEFAULT_MAX_SIZE_MB = 2048
+
+# Leading bytes of each image format we expect to be served
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+def sniff_format(filename):
+    with open(filename, 'rb') as f:
+        header = f.read(16)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return 'bin'
+
+
+@dataclass
+class CacheEntry:
+    uri: str
+    blob_hash: str
+    path: str
+    size: int
+    format: str
+    etag: str | None
+    last_modified: str | None
+
+    @property
+    def validators(self):
+        return {'etag': self.etag, 'last_modified': self.last_modified}
+
+
+class ImageCache:
+    """Content addressed store for downloaded images.
+
+    Files are stored once per distinct content under blobs/, named by
+    their sha256, and a SQLite manifest maps each URI to its blob along
+    with the validators it was served with. Blobs not used by the current
+    run are evicted least recently used first once the cache grows past
+    max_bytes."""
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(cache_dir, BLOB_DIR)
+        self.incoming_dir = os.path.join(cache_dir, INCOMING_DIR)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self.run_started = time.time()
+        self.lock = threading.Lock()
+        # Downloads finish on worker threads, every access goes through self.lock
+        self.db = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE), check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                hash text PRIMARY KEY, size integer, format text, last_used real);''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS uris (
+                uri text PRIMARY KEY, blob_hash text, etag text, last_modified text, fetched_at real,
+                FOREIGN KEY(blob_hash) REFERENCES blobs(hash));''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS uris_blob_hash ON uris (blob_hash);')
+            self.db.execute('CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);')
+
+    def blob_path(self, blob_hash, image_format):
+        return os.path.join(self.blob_dir, blob_hash[:2], f'{blob_hash}.{image_format}')
+
+    def incoming_path(self, uri):
+        """Where a download of uri should be written before it is stored"""
+        return os.path.join(self.incoming_dir, hashlib.sha256(uri.encode('utf-8')).hexdigest())
+
+    def lookup(self, uri) -> CacheEntry | None:
+        """Returns the cached entry for uri, or None if it has not been
+        downloaded or its blob has gone missing"""
+        with self.lock:
+            row = self.db.execute('''SELECT uris.blob_hash, blobs.size, blobs.format, uris.etag, uris.last_modified
+            FROM uris JOIN blobs ON blobs.hash = uris.blob_hash WHERE uris.uri = ?;''', (uri, )).fetchone()
+        if row is None:
+            return None
+        blob_hash, size, image_format, etag, last_modified = row
+        entry = CacheEntry(uri, blob_hash, self.blob_path(blob_hash, image_format), size, image_format,
+                           etag, last_modified)
+        if not os.path.exists(entry.path):
+            logger.warning(f'Cached blob {entry.path} for {uri} is missing')
+            return None
+        return entry
+
+    def lookup_hash(self, blob_hash) -> str | None:
+        """Returns the path of the blob with the given content hash"""
+        with self.lock:
+            row = self.db.execute('SELECT format FROM blobs WHERE hash = ?;', (blob_hash, )).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(blob_hash, row[0])
+        return path if os.path.exists(path) else None
+
+    def store(self, uri, filename, blob_hash, etag=None, last_modified=None) -> CacheEntry:
+        """Moves a freshly downloaded file into the cache as the content
+        of uri. Content that is already cached is not stored twice"""
+        image_format = sniff_format(filename)
+        path = self.blob_path(blob_hash, image_format)
+        size = os.path.getsize(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(filename)
+        else:
+            os.replace(filename, path)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('''INSERT INTO blobs (hash, size, format, last_used) VALUES (?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET last_used = excluded.last_used;''',
+                            (blob_hash, size, image_format, now))
+            self.db.execute('''INSERT OR REPLACE INTO uris (uri, blob_hash, etag, last_modified, fetched_at)
+            VALUES (?, ?, ?, ?, ?);''', (uri, blob_hash, etag, last_modified, now))
+        return CacheEntry(uri, blob_hash, path, size, image_format, etag, last_modified)
+
+    def touch(self, entry: CacheEntry):
+        with self.lock, self.db:
+            self.db.execute('UPDATE blobs SET last_used = ? WHERE hash = ?;', (time.time(), entry.blob_hash))
+
+    def total_size(self):
+        with self.lock:
+            return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs;').fetchone()[0]
+
+    def evict(self):
+        """Removes least recently used blobs until the cache fits in
+        max_bytes. Blobs used during this run are never evicted"""
+        if not self.max_bytes:
+            return
+        total = self.total_size()
+        if total <= self.max_bytes:
+            return
+        with self.lock:
+            candidates = self.db.execute('''SELECT hash, size, format FROM blobs
+            WHERE last_used < ? ORDER BY last_used;''', (self.run_started, )).fetchall()
+        evicted = []
+        for blob_hash, size, image_format in candidates:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.blob_path(blob_hash, image_format))
+            evicted.append((blob_hash, ))
+            total -= size
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM uris WHERE blob_hash = ?;', evicted)
+            self.db.executemany('DELETE FROM blobs WHERE hash = ?;', evicted)
+        logger.info(f'Evicted {len(evicted)} cached images, cache is now {total // (1024 * 1024)} MiB')
+        if total > self.max_bytes:
+            logger.warning(f'Images used by this run alone exceed the {self.max_bytes // (1024 * 1024)} MiB cache limit')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,55 +1,209 @@
 import re
-import os
-import shutil
 import logging
-import urllib.request
+import collections
+import contextlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+from nyan_tcg_game.build_manifest import card_key
+from nyan_tcg_game.downloader import Downloader
+from nyan_tcg_game.image_cache import ImageCache
+from nyan_tcg_game import profiling
 
 invalid_character_selector = re.compile(r'[()\'\"\[\]\{\}]')
 
 logger = logging.getLogger(__name__)
 
 
-def download_url_for_empty_filename(card, image_dir, log_file):
-    """For cards with an empty image_url, this function downloads the
-    image at the card's image_source url as the card's image data"""
+@contextlib.contextmanager
+def open_image_cache(source):
+    """Yields source unchanged if it is already an ImageCache, otherwise
+    opens the named directory as one for the duration of the block"""
+    if isinstance(source, ImageCache):
+        yield source
+    else:
+        with ImageCache(source) as cache:
+            yield cache
+
+
+class CacheDownloads:
+    """Queues the downloads for one run against the image cache. Cards
+    that share a File URI share a single download, and a URI that is
+    already cached is not fetched again unless revalidating"""
+    def __init__(self, cache: ImageCache, downloader: Downloader, revalidate=False):
+        self.cache = cache
+        self.downloader = downloader
+        self.revalidate = revalidate
+        self.futures = {}
+
+    def submit(self, uri):
+        """Returns a Future resolving to the CacheEntry holding uri"""
+        if uri not in self.futures:
+            self.futures[uri] = self._submit(uri)
+        return self.futures[uri]
+
+    def _submit(self, uri):
+        entry = self.cache.lookup(uri)
+        if entry and not (self.revalidate and urlparse(uri).scheme in ('http', 'https')):
+            logger.debug(f'Using cached {entry.path} for {uri}')
+            self.cache.touch(entry)
+            future = Future()
+            future.set_result(entry)
+            return future
+
+        if entry:
+            logger.debug(f'Revalidating {uri} with {entry.validators}')
+        else:
+            logger.info(f'Downloading {uri}')
+        start = time.perf_counter_ns()
+        download = self.downloader.submit(uri, self.cache.incoming_path(uri),
+                                          entry.validators if entry else None)
+        future = Future()
+
+        def store(download):
+            # Runs on the download thread, so moving the file into the
+            # cache never holds up the caller
+            try:
+                result = download.result()
+                profiling.add_span(uri, 'download', start, time.perf_counter_ns(), bytes=result.num_bytes)
+                profiling.add_bytes('downloaded', result.num_bytes)
+                if result.not_modified:
+                    self.cache.touch(entry)
+                    stored = entry
+                else:
+                    stored = self.cache.store(uri, self.cache.incoming_path(uri), result.sha256,
+                                              result.etag, result.last_modified)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(stored)
+
+        download.add_done_callback(store)
+        return future
+
+
+def submit_card_download(card, downloads: CacheDownloads):
+    """Queues the download of a card's image. Returns a Future for the
+    download, or None if the card has no image to download"""
     if not card.image_file_uri:
         logger.error(f"Cannot find image file for card {card}")
+        return None
+    logger.debug(f'Attempting to fixup {card}')
+    return downloads.submit(card.image_file_uri)
+
+def finish_card_download(card, future, log_file, manifest=None):
+    """Waits on a card's download, returning the card or None if it failed"""
+    if future is None:
         return card
+    try:
+        entry = future.result()
+    except Exception as e:
+        logger.error(f'Error downloading {card.image_file_uri}: {e}')
+        if log_file:
+            log_file.write(f'Error downloading image for Card: {card.name}, {card.variant}: '
+                           f'{card.image_file_uri}\n')
+        if manifest:
+            manifest.record_failure(f'download/{card_key(card)}', e)
+        return None
+    card.local_image_path = entry.path
+    card.source_image_hash = entry.blob_hash
+    return card
 
-    logger.debug(f'Attempting to fixup {card}')
-    image_filename = card.get_image_filename('.png')
-    output_filename = os.path.join(image_dir, image_filename)
-    if not os.path.exists(output_filename):
-        logger.info(f'Downloading {card.image_file_uri} as {output_filename}')
-        if 'pximg' in card.image_file_uri or 'pixiv' in card.image_file_uri:
-            logger.info(f"Adding pixiv specific headers the request for {output_filename}")
-            opener = urllib.request.build_opener()
-            opener.addheaders = [('referer', 'https://www.pixiv.net/')]
-            urllib.request.install_opener(opener)
-        else:
-            urllib.request.install_opener(None)
+def download_missing_images(cards, cache, downloader=None, revalidate=False, bad_urls_file=None, manifest=None):
+    """Lazily yields each card once its image is available in the image
+    cache, dropping cards whose image could not be fetched. Downloads run
+    in parallel on the downloader, cards are yielded in their original
+    order. cache is an ImageCache or the directory to open one in. Failed
+    downloads are listed in bad_urls_file when it is given, and recorded
+    as failures in the build manifest so a rerun retries them"""
+    owns_downloader = downloader is None
+    if owns_downloader:
+        downloader = Downloader()
+    # Keep enough downloads queued that every worker stays busy without
+    # pulling the whole card list into memory
+    window = downloader.max_workers * 4
+    try:
+        with profiling.span('download'), open_image_cache(cache) as cache, \
+             (open(bad_urls_file, 'w') if bad_urls_file else contextlib.nullcontext()) as log_file:
+            downloads = CacheDownloads(cache, downloader, revalidate)
+            pending = collections.deque()
+            for card in cards:
+                pending.append((card, submit_card_download(card, downloads)))
+                while len(pending) > window:
+                    card = finish_card_download(*pending.popleft(), log_file, manifest)
+                    if card:
+                        yield card
+            while pending:
+                card = finish_card_download(*pending.popleft(), log_file, manifest)
+                if card:
+                    yield card
+            logger.info(downloader.progress.summary())
+            cache.evict()
+    finally:
+        if owns_downloader:
+            downloader.close()
+
+
+_END = object()
 
+class CardFeed:
+    """Runs an iterable of cards, such as download_missing_images, on a
+    background thread so cards can be worked on as they arrive.
+
+    Iterating the feed yields the cards in order as they arrive, poll
+    returns whatever has arrived without waiting, and the done Future
+    resolves to the complete list once the iterable is exhausted"""
+    def __init__(self, cards):
+        self.queue = queue.SimpleQueue()
+        self.exhausted = False
+        self.done = Future()
+        self.thread = threading.Thread(target=self._run, args=(cards, ), name='card-feed', daemon=True)
+        self.thread.start()
+
+    def _run(self, cards):
+        arrived = []
         try:
-            urllib.request.urlretrieve(card.image_file_uri, output_filename)
+            for card in cards:
+                arrived.append(card)
+                self.queue.put(card)
         except Exception as e:
-            logger.error(f'Error downloading {card.image_file_uri}: {e}')
-            log_file.write(f'Error downloading image for Card: {card.name}, {card.variant}: {card.image_file_uri}\n')
+            self.done.set_exception(e)
+        else:
+            self.done.set_result(arrived)
+        finally:
+            self.queue.put(_END)
+
+    def _take(self, block, timeout=None):
+        """The next card, or None if the feed is exhausted or none has
+        arrived yet"""
+        if self.exhausted:
             return None
-    else:
-        logger.debug(f'Skipping {output_filename} as it already exists')
-    card.local_image_path = output_filename
-    return card
+        try:
+            card = self.queue.get(block, timeout)
+        except queue.Empty:
+            return None
+        if card is _END:
+            self.exhausted = True
+            return None
+        return card
 
-def download_missing_images(cards, download_dir):
-    os.makedirs(download_dir, exist_ok=True)
-    with open('bad_urls.txt', 'w') as log_file:
-        return list(filter(None,
-                           map(lambda c: download_url_for_empty_filename(c, download_dir, log_file), cards)))
+    def poll(self, timeout=None) -> list:
+        """Returns the cards that have arrived since the last poll, waiting
+        up to timeout for the first one"""
+        cards = []
+        card = self._take(timeout is not None, timeout)
+        while card is not None:
+            cards.append(card)
+            card = self._take(False)
+        return cards
 
-def fix_image_files(cards, image_dir):
-    os.makedirs(image_dir, exist_ok=True)
-    with open('bad_urls.txt', 'w') as log_file:
-        def run(card):
-            return download_url_for_empty_filename(card, image_dir, log_file)
+    def __iter__(self):
+        while (card := self._take(True)) is not None:
+            yield card
 
-        return list(map(run, cards))
+    def result(self) -> list:
+        """Waits for every card, re-raising anything the iterable raised"""
+        return self.done.result()
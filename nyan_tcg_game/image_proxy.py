@@ -0,0 +1,140 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from nyan_tcg_game.crop_recipes import composite_background
+
+logger = logging.getLogger(__name__)
+
+# Stop halving once the smaller side of a level would drop below this,
+# nothing is ever displayed smaller
+MIN_LEVEL_SIZE = 256
+DISPLAY_RESAMPLE = Image.LANCZOS
+
+
+class ImagePyramid:
+    """Successively halved copies of an image, used to draw it at screen
+    size without resampling the full resolution original every time.
+
+    The largest level does not need to be the full resolution image, a
+    reduced decode works as long as full_size gives the original size so
+    display coordinates still map back onto the original."""
+    def __init__(self, image, full_size=None, min_size=MIN_LEVEL_SIZE):
+        image = image.convert('RGBA')
+        self.full_size = full_size or image.size
+        self.levels = [image]
+        while min(self.levels[-1].size) // 2 >= min_size:
+            self.levels.append(self.levels[-1].reduce(2))
+        self._display_cache = None
+
+    @property
+    def nbytes(self):
+        return sum(level.width * level.height * 4 for level in self.levels)
+
+    def level_for(self, size):
+        """The smallest level at least as large as size"""
+        for level in reversed(self.levels):
+            if level.width >= size[0] and level.height >= size[1]:
+                return level
+        return self.levels[0]
+
+    def render(self, size, background_fill):
+        """Returns the image scaled to size, composited over
+        background_fill. The result for the last size is cached so fill
+        changes only redo the cheap display resolution composite"""
+        if self._display_cache is None or self._display_cache[0] != size:
+            scaled = self.level_for(size).resize(size, DISPLAY_RESAMPLE)
+            self._display_cache = (size, scaled)
+        return composite_background(self._display_cache[1], background_fill)
+
+
+def load_display_image(path, display_size, min_size=MIN_LEVEL_SIZE):
+    """Decodes path into an ImagePyramid no larger than needed to show it
+    at display_size. JPEGs are decoded at a reduced scale with draft, any
+    other format is decoded in full and reduced by a whole factor"""
+    with Image.open(path) as image:
+        full_size = image.size
+        # The size the whole image is shown at when it fills display_size
+        scale = min(display_size[0] / image.width, display_size[1] / image.height, 1)
+        fitted = (max(int(image.width * scale), 1), max(int(image.height * scale), 1))
+        if image.format == 'JPEG':
+            image.draft('RGB', fitted)
+        image = image.convert('RGBA')
+    factor = min(image.width // fitted[0], image.height // fitted[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    return ImagePyramid(image, full_size, min_size)
+
+
+DEFAULT_PREFETCH_AHEAD = 4
+DEFAULT_PREFETCH_MAX_SIZE_MB = 512
+
+
+class ImagePrefetcher:
+    """Decodes the display images of upcoming cards on a background thread,
+    so moving to the next card does not wait on decoding it.
+
+    Up to ahead cards past the current one are loaded, but no new load is
+    started while the finished ones already hold max_bytes. Pyramids do not
+    depend on the card's background fill, so a fill change never throws a
+    prefetched image away"""
+    def __init__(self, cards, display_size, ahead=DEFAULT_PREFETCH_AHEAD,
+                 max_bytes=DEFAULT_PREFETCH_MAX_SIZE_MB * 1024 * 1024):
+        self.cards = cards
+        self.display_size = display_size
+        self.ahead = ahead
+        self.max_bytes = max_bytes
+        self.current = 0
+        # Loads that finish straight away run their callback inside _fill
+        self.lock = threading.RLock()
+        self.closed = False
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+
+    def _load(self, index):
+        return load_display_image(self.cards[index].local_image_path, self.display_size)
+
+    def _loaded_bytes(self):
+        return sum(future.result().nbytes for future in self.futures.values()
+                   if future.done() and not future.exception())
+
+    def _fill(self):
+        with self.lock:
+            if self.closed:
+                return
+            last = min(self.current + self.ahead, len(self.cards) - 1)
+            for index in range(self.current, last + 1):
+                if index in self.futures:
+                    continue
+                # The current card is always loaded, however large
+                if index > self.current and self._loaded_bytes() >= self.max_bytes:
+                    logger.debug(f'Prefetch memory budget reached, not loading card {index} yet')
+                    break
+                future = self.executor.submit(self._load, index)
+                future.add_done_callback(self._on_loaded)
+                self.futures[index] = future
+
+    def _on_loaded(self, future):
+        # Another load may fit in the budget now
+        self._fill()
+
+    def get(self, index) -> ImagePyramid:
+        """Moves the prefetch window to index and returns its image,
+        waiting for it if it has not been decoded yet"""
+        with self.lock:
+            self.current = index
+            # Skipping backwards or jumping ahead leaves loads outside the window
+            for stale in [i for i in self.futures if i < index or i > index + self.ahead]:
+                self.futures.pop(stale).cancel()
+        self._fill()
+        with self.lock:
+            future = self.futures[index]
+        return future.result()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.futures.clear()
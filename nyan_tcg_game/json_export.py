@@ -1,8 +1,11 @@
+import itertools
 import json
 import logging
+import os
 from pydantic.json import pydantic_encoder
 from pydantic import TypeAdapter
 from nyan_tcg_game.schemas import NyanCard, Bundle, Pack
+from nyan_tcg_game.downloader import open_atomic, write_atomic
 logger = logging.getLogger(__name__)
 
 
@@ -26,3 +29,77 @@ def export_bundle_json(bundles, output_filename):
 def export_pack_json(pack: Pack, output_filename: str):
     with open(output_filename, 'w', encoding='utf-8') as f:
         f.write(pack.model_dump_json(indent=2, by_alias=True))
+
+
+SHARD_INDEX_FILE = 'index.json'
+DEFAULT_SHARD_SIZE = 1000
+
+
+def write_shards(models, output_dir, prefix, shard_size, index):
+    """Streams models one compact JSON line at a time into numbered
+    prefix-NNNNN.jsonl files of at most shard_size lines, recording the
+    shard, byte offset and length of each in index under its name.
+    Returns the filenames written"""
+    models = iter(models)
+    shards = []
+    # Each pass of the outer loop takes the first model of the next shard
+    for first in models:
+        shards.append(f'{prefix}-{len(shards):05d}.jsonl')
+        with open_atomic(os.path.join(output_dir, shards[-1])) as f:
+            offset = 0
+            for model in itertools.chain([first], itertools.islice(models, shard_size - 1)):
+                line = model.model_dump_json(by_alias=True).encode('utf-8') + b'\n'
+                if model.name in index:
+                    logger.warning(f'Duplicate {prefix} name {model.name!r}, only the first is indexed')
+                else:
+                    index[model.name] = [len(shards) - 1, offset, len(line)]
+                f.write(line)
+                offset += len(line)
+    return shards
+
+def export_pack_shards(name, cards, bundles, output_dir, shard_size=DEFAULT_SHARD_SIZE):
+    """Writes a pack as JSONL shards of cards and bundles plus an index of
+    where each card and bundle is, so a single one can be read without
+    parsing the whole pack. cards and bundles can be any iterables of
+    NyanCard and Bundle, only one line is held in memory at a time"""
+    os.makedirs(output_dir, exist_ok=True)
+    card_index = {}
+    bundle_index = {}
+    card_shards = write_shards(cards, output_dir, 'cards', shard_size, card_index)
+    bundle_shards = write_shards(bundles, output_dir, 'bundles', shard_size, bundle_index)
+    # Shards left over from a larger pack would otherwise linger
+    for filename in os.listdir(output_dir):
+        if filename.endswith('.jsonl') and filename not in card_shards + bundle_shards:
+            os.remove(os.path.join(output_dir, filename))
+    index = {
+        'name': name,
+        'card_shards': card_shards,
+        'bundle_shards': bundle_shards,
+        'cards': card_index,
+        'bundles': bundle_index,
+    }
+    write_atomic(os.path.join(output_dir, SHARD_INDEX_FILE), json.dumps(index).encode('utf-8'))
+    logger.info(f'Wrote {len(card_index)} cards and {len(bundle_index)} bundles '
+                f'in {len(card_shards) + len(bundle_shards)} shards to {output_dir}')
+
+
+class ShardedPack:
+    """Reads single cards and bundles out of a pack written by
+    export_pack_shards"""
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SHARD_INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.name = self.index['name']
+
+    def _read(self, shards, location):
+        shard, offset, length = location
+        with open(os.path.join(self.directory, shards[shard]), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def card(self, name) -> NyanCard:
+        return NyanCard.model_validate_json(self._read(self.index['card_shards'], self.index['cards'][name]))
+
+    def bundle(self, name) -> Bundle:
+        return Bundle.model_validate_json(self._read(self.index['bundle_shards'], self.index['bundles'][name]))
@@ -1,71 +1,444 @@
 import argparse
+import itertools
 import logging
 import os
-import nyan_tcg_game.ods_parser as ods_parser
-from nyan_tcg_game.cards import parse_cards
-from nyan_tcg_game.image_files import fix_image_files, download_missing_images
-from nyan_tcg_game.json_export import export_pack_json
-from nyan_tcg_game.crop_gui import crop_images
-from nyan_tcg_game.bundles import parse_bundles
-from nyan_tcg_game.schemas import BundleType, Pack, NyanCard
-from nyan_tcg_game.card_preview import generate_previews
-from nyan_tcg_game.stats import generate_stats
+import sys
+
+# Only what every command needs is imported here, each command imports the
+# rest itself so the headless ones never load the GUI or image stack
 
 PACK_FILE = 'pack_data.json'
+PACK_SHARD_DIR = 'pack_shards'
 STATS_FILE = 'pack_stats.txt'
 IMAGE_DIR = 'images'
+PREVIEW_DIR = 'previews'
 DOWNLOAD_CACHE_DIR = 'downloaded_images'
+BAD_URLS_FILE = 'bad_urls.txt'
 
+logger = logging.getLogger(__name__)
 
-def get_args():
-    parser = argparse.ArgumentParser()
+
+def add_download_arguments(parser):
+    from nyan_tcg_game.downloader import DEFAULT_MAX_WORKERS
+    from nyan_tcg_game.image_cache import DEFAULT_MAX_SIZE_MB
+    parser.add_argument('--cache-dir', type=str, default='.cache', help='Directory to cache temporary images')
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Maximum number of images downloaded at once')
+    parser.add_argument('--host-limit', action='append', default=[], metavar='HOST=N',
+                        help='Maximum number of simultaneous downloads from HOST, can be repeated')
+    parser.add_argument('--cache-max-size', type=int, default=DEFAULT_MAX_SIZE_MB, metavar='MB',
+                        help='Evict the least recently used downloads once the cache exceeds this size, 0 for no limit')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Check already downloaded images against the remote and refetch changed ones')
+    parser.add_argument('--preflight', action='store_true',
+                        help='Check the whole sheet and every image URI first, stopping before any download '
+                        'if there are errors')
+
+def add_crop_arguments(parser):
+    from nyan_tcg_game.image_proxy import DEFAULT_PREFETCH_AHEAD, DEFAULT_PREFETCH_MAX_SIZE_MB
+    parser.add_argument('--rerender', action='store_true',
+                        help='Rebuild every cropped image from its saved crop recipe instead of opening the crop GUI')
+    parser.add_argument('--auto-crop', action='store_true',
+                        help='Pick the crop of every uncropped image automatically instead of opening the crop GUI')
+    parser.add_argument('--review', action='store_true',
+                        help='With --auto-crop, open the crop GUI afterwards with each automatic crop drawn in')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH_AHEAD,
+                        help='Number of upcoming images the crop GUI decodes in the background')
+    parser.add_argument('--prefetch-memory', type=int, default=DEFAULT_PREFETCH_MAX_SIZE_MB, metavar='MB',
+                        help='Stop decoding upcoming images once they take up this much memory')
+
+def add_workers_argument(parser):
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes used for image processing, defaults to the number of CPUs')
+
+def add_stats_db_arguments(parser):
+    parser.add_argument('--stats-db', type=str, default=None,
+                        help='Add the stats of this edition to a stats database kept across editions')
+    parser.add_argument('--pack-id', type=str, default=None,
+                        help='Name the editions of this pack share in the stats database, defaults to the pack name')
+    parser.add_argument('--edition', type=str, default=None,
+                        help='Name of this edition in the stats database, defaults to the pack name when '
+                        '--pack-id is given and to a hash of the pack otherwise')
+
+def download_arguments(parser):
+    parser.add_argument('ods_input', type=str, help="ODS sheet of input data")
+    add_download_arguments(parser)
+
+def crop_arguments(parser):
+    parser.add_argument('ods_input', type=str, help="ODS sheet of input data")
+    parser.add_argument('export_dir', type=str, help="Directory to export json and images to")
+    add_download_arguments(parser)
+    add_crop_arguments(parser)
+    add_workers_argument(parser)
+
+def export_arguments(parser):
+    from nyan_tcg_game.encoding import IMAGE_FORMATS
+    from nyan_tcg_game.json_export import DEFAULT_SHARD_SIZE
+    from nyan_tcg_game import profiling
     parser.add_argument('ods_input', type=str, help="ODS sheet of input data")
     parser.add_argument('export_dir', type=str, help="Directory to export json and images to")
     parser.add_argument('pack_name', type=str, help="The name of the pack edition")
-    parser.add_argument('--log-level', type=str, default='INFO', help="Sets log level")
-    parser.add_argument('--cache-dir', type=str, default='.cache', help='Directory to cache temporary images')
     parser.add_argument('-p', '--preview', action='store_true', help='Preview card frames')
-    return parser.parse_args()
+    add_download_arguments(parser)
+    add_crop_arguments(parser)
+    parser.add_argument('--image-format', choices=IMAGE_FORMATS, default=None,
+                        help='Encode the exported card images in this format, by default the crops are exported as is')
+    parser.add_argument('--compress-level', type=int, default=9, choices=range(10), metavar='0-9',
+                        help='zlib compression level of PNG card images')
+    parser.add_argument('--colors', type=int, default=None,
+                        help='Quantise PNG card images to a palette of this many colors when the loss is small')
+    parser.add_argument('--quality', type=int, default=None, metavar='0-100',
+                        help='Lossy WebP quality, WebP card images are lossless without it')
+    parser.add_argument('--thumbnail-width', type=int, action='append', default=[], metavar='WIDTH',
+                        help='Also export a thumbnail of every card image at this width, can be repeated')
+    parser.add_argument('--sharded', action='store_true',
+                        help=f'Also export the pack as JSONL shards with an index of every card and bundle into {PACK_SHARD_DIR}')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help='Number of cards or bundles in each shard')
+    parser.add_argument('--since', type=str, default=None, metavar='PREVIOUS_EXPORT_DIR',
+                        help='Also write the changes since the pack exported to this directory to pack_delta.json')
+    add_stats_db_arguments(parser)
+    add_workers_argument(parser)
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Time each stage and card, writing {profiling.TRACE_FILE} and '
+                        f'{profiling.SUMMARY_FILE} to the export directory')
 
+def preview_arguments(parser):
+    parser.add_argument('export_dir', type=str, help="Directory a pack was exported to")
+    add_workers_argument(parser)
 
-def main():
-    args = get_args()
-    logging.basicConfig(level=args.log_level)
-    #logging.getLogger("nyan_tcg_game.crop_gui").setLevel(logging.DEBUG)
+def stats_arguments(parser):
+    parser.add_argument('export_dir', type=str, help="Directory a pack was exported to")
+    add_stats_db_arguments(parser)
+
+
+def download(args):
+    """Fills the image cache from the card sheet without cropping"""
+    import nyan_tcg_game.ods_parser as ods_parser
+    from nyan_tcg_game.cards import parse_cards
+    from nyan_tcg_game.image_files import download_missing_images
 
+    check_sheet(args, args.cache_dir)
+    downloader, image_cache = open_downloads(args)
+    with downloader, image_cache, ods_parser.Workbook(args.ods_input) as workbook:
+        cards = download_missing_images(parse_cards(ods_parser.iter_card_data(workbook)), image_cache,
+                                        downloader, revalidate=args.revalidate,
+                                        bad_urls_file=os.path.join(args.cache_dir, BAD_URLS_FILE))
+        logger.info(f'{sum(1 for _ in cards)} card images are in {image_cache.cache_dir}')
+
+def check_sheet(args, report_dir):
+    """With --preflight, checks the sheet before anything is downloaded and
+    exits if it has errors"""
+    if not args.preflight:
+        return
+    from nyan_tcg_game.downloader import Downloader, parse_host_limits
+    from nyan_tcg_game.preflight import PREFLIGHT_FILE, preflight
+    with Downloader(max_workers=args.download_workers,
+                    host_limits=parse_host_limits(args.host_limit)) as downloader:
+        if not preflight(args.ods_input, downloader, report_dir):
+            sys.exit(f'{args.ods_input} failed the preflight checks, see {os.path.join(report_dir, PREFLIGHT_FILE)}')
+
+def open_downloads(args):
+    from nyan_tcg_game.downloader import Downloader, parse_host_limits
+    from nyan_tcg_game.image_cache import ImageCache
+    downloader = Downloader(max_workers=args.download_workers,
+                            host_limits=parse_host_limits(args.host_limit))
+    image_cache = ImageCache(os.path.join(args.cache_dir, DOWNLOAD_CACHE_DIR),
+                             max_bytes=args.cache_max_size * 1024 * 1024)
+    return downloader, image_cache
+
+def crop_cards(args, feed, image_cache, manifest, recipes):
+    """Crops the cards arriving through feed the way args asks for,
+    returning every card that downloaded"""
     image_directory = os.path.join(args.export_dir, IMAGE_DIR)
+    if args.rerender:
+        from nyan_tcg_game.crop_recipes import rerender_crops
+        return rerender_crops(feed, image_directory, args.export_dir, recipes, image_cache, args.workers, manifest)
+    if args.auto_crop:
+        from nyan_tcg_game.auto_crop import auto_crop_images
+        return auto_crop_images(feed, image_directory, args.export_dir, manifest, recipes, args.workers,
+                                args.review)
+    from nyan_tcg_game.crop_gui import crop_images
+    return crop_images(feed, image_directory, args.export_dir, manifest, recipes,
+                       args.prefetch, args.prefetch_memory * 1024 * 1024)
+
+def crop(args):
+    """Downloads and crops the card images without exporting the pack"""
+    import nyan_tcg_game.ods_parser as ods_parser
+    from nyan_tcg_game.build_manifest import BuildManifest
+    from nyan_tcg_game.cards import parse_cards
+    from nyan_tcg_game.crop_recipes import RecipeStore
+    from nyan_tcg_game.image_files import CardFeed, download_missing_images
+
+    os.makedirs(args.export_dir, exist_ok=True)
+    check_sheet(args, args.export_dir)
+    manifest = BuildManifest(args.export_dir)
+    downloader, image_cache = open_downloads(args)
+    with downloader, image_cache, ods_parser.Workbook(args.ods_input) as workbook:
+        feed = CardFeed(download_missing_images(parse_cards(ods_parser.iter_card_data(workbook)), image_cache,
+                                                downloader, revalidate=args.revalidate,
+                                                bad_urls_file=os.path.join(args.export_dir, BAD_URLS_FILE),
+                                                manifest=manifest))
+        crop_cards(args, feed, image_cache, manifest, RecipeStore(args.export_dir))
+    manifest.save_partial()
+
+
+def build_bundles(bundle_data, feed):
+    """Parses the bundles once every card has downloaded, returning them
+    with their compiled membership"""
+    from nyan_tcg_game.bundles import parse_bundles, compile_bundles
+    from nyan_tcg_game.schemas import NyanCard
+    from nyan_tcg_game import profiling
+    cards = feed.result()
+    with profiling.span('bundles'):
+        bundles = parse_bundles(bundle_data, cards)
+        return bundles, compile_bundles(bundles, list(map(NyanCard.from_card, cards)))
+
+def build_stats(pack_name, feed, bundles_done, stats_filename, manifest):
+    """Writes the pack stats, which only depend on the cards and bundles
+    and not on their images"""
+    from nyan_tcg_game.schemas import NyanCard, Pack
+    cards = list(map(NyanCard.from_card, feed.result()))
+    bundles, _ = bundles_done.result()
+    write_pack_stats(Pack(name=pack_name, cards=cards, bundles=bundles), stats_filename, manifest)
+
+def write_pack_stats(pack, stats_filename, manifest):
+    from nyan_tcg_game.build_manifest import hash_inputs
+    from nyan_tcg_game.stats import generate_stats
+    stats_inputs = hash_inputs([(card.name, card.character, card.subtext, card.rarity) for card in pack.cards],
+                               [bundle.model_dump(mode='json', by_alias=True) for bundle in pack.bundles])
+    if not manifest.is_current('stats', stats_inputs, stats_filename):
+        generate_stats(pack, stats_filename)
+        manifest.record('stats', stats_inputs, stats_filename)
+
+def write_stats_db(pack, args, manifest):
+    from nyan_tcg_game.build_manifest import hash_inputs
+    from nyan_tcg_game.stats_warehouse import StatsWarehouse, TRENDS_FILE
+    from nyan_tcg_game import profiling
+    trends_filename = os.path.join(args.export_dir, TRENDS_FILE)
+    pack_id = args.pack_id or pack.name
+    with StatsWarehouse(args.stats_db) as warehouse, open(trends_filename, 'w') as f:
+        warehouse.ingest(pack, args.edition, pack_id)
+        warehouse.print_trends(pack_id, f)
+    profiling.add_written(trends_filename)
+    manifest.record('trends', hash_inputs(pack.model_dump(mode='json', by_alias=True), pack_id), trends_filename)
+
+
+def export(args):
+    """Runs every stage, from the spreadsheet to the exported pack"""
+    from concurrent.futures import ThreadPoolExecutor
+    from dataclasses import asdict
+    import nyan_tcg_game.ods_parser as ods_parser
+    from nyan_tcg_game.build_manifest import BuildManifest, hash_file, hash_inputs
+    from nyan_tcg_game.cards import BundleType, parse_cards
+    from nyan_tcg_game.card_preview import generate_previews
+    from nyan_tcg_game.crop_recipes import RecipeStore
+    from nyan_tcg_game.encoding import EncodeSettings, encode_images
+    from nyan_tcg_game.image_files import CardFeed, download_missing_images
+    from nyan_tcg_game.json_export import export_pack_json, export_pack_shards, SHARD_INDEX_FILE
+    from nyan_tcg_game.pack_delta import DELTA_FILE, export_pack_delta
+    from nyan_tcg_game.schemas import Pack, NyanCard
+    from nyan_tcg_game import profiling
+
     pack_filename = os.path.join(args.export_dir, PACK_FILE)
     stats_filename = os.path.join(args.export_dir, STATS_FILE)
-    download_cache_dir = os.path.join(args.cache_dir, DOWNLOAD_CACHE_DIR)
 
-    # Handle card data
+    os.makedirs(args.export_dir, exist_ok=True)
+    if args.preflight:
+        with profiling.span('preflight'):
+            check_sheet(args, args.export_dir)
+    manifest = BuildManifest(args.export_dir)
+    encode_settings = None
+    if args.image_format:
+        encode_settings = EncodeSettings(args.image_format, args.compress_level, args.colors, args.quality)
+    run_inputs = {'sheet': hash_file(args.ods_input), 'pack_name': args.pack_name, 'preview': args.preview,
+                  'sharded': args.sharded and args.shard_size,
+                  'encoding': encode_settings and asdict(encode_settings),
+                  'thumbnails': sorted(set(args.thumbnail_width)),
+                  'since': args.since and hash_file(os.path.join(args.since, PACK_FILE)),
+                  'stats_db': args.stats_db and [os.path.abspath(args.stats_db), args.pack_id, args.edition]}
+    if not args.revalidate and not args.rerender and manifest.up_to_date(run_inputs):
+        logger.info(f'{args.export_dir} is up to date with {args.ods_input}, nothing to do')
+        profiling.discard()
+        return
 
-    card_data = ods_parser.read_card_data(args.ods_input)
-    cards = parse_cards(card_data)
-    cards = download_missing_images(cards, download_cache_dir)
-    cards = crop_images(cards, image_directory, args.export_dir)
+    # Bundles and stats only depend on which cards downloaded, so they run
+    # alongside cropping
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='stage') as stages:
+        # The card sheet streams in while the images download, so the
+        # workbook stays open until cropping is done
+        with ods_parser.Workbook(args.ods_input) as workbook:
+            with profiling.span('parse'):
+                # The bundle sheets are small, they are read up front
+                bundle_data = list(itertools.chain(
+                    ods_parser.iter_bundle_data(workbook, BundleType.CARD),
+                    ods_parser.iter_bundle_data(workbook, BundleType.CHARACTER),
+                    ods_parser.iter_bundle_data(workbook, BundleType.BUNDLE)))
 
-    # Handle bundles
-    def parse_bundle_data():
-        bundle_data = ods_parser.read_bundle_data(args.ods_input, BundleType.CARD)
-        bundle_data.extend(ods_parser.read_bundle_data(args.ods_input, BundleType.CHARACTER))
-        bundle_data.extend(ods_parser.read_bundle_data(args.ods_input, BundleType.BUNDLE))
-        return parse_bundles(bundle_data, cards)
+            # Handle card data
 
-    bundles = parse_bundle_data()
+            card_data = ods_parser.iter_card_data(workbook)
+            cards = parse_cards(card_data)
+            downloader, image_cache = open_downloads(args)
+            recipes = RecipeStore(args.export_dir)
+            with downloader, image_cache, profiling.span('crop'):
+                # Cards reach the crop stage as soon as their image is downloaded
+                feed = CardFeed(download_missing_images(cards, image_cache, downloader, revalidate=args.revalidate,
+                                                        bad_urls_file=os.path.join(args.export_dir, BAD_URLS_FILE),
+                                                        manifest=manifest))
+                bundles_done = stages.submit(build_bundles, bundle_data, feed)
+                stats_done = stages.submit(build_stats, args.pack_name, feed, bundles_done, stats_filename,
+                                           manifest)
+                cards = crop_cards(args, feed, image_cache, manifest, recipes)
 
-    nyancards = list(map(NyanCard.from_card, cards))
+        if encode_settings or args.thumbnail_width:
+            with profiling.span('encode'):
+                cards = encode_images(cards, args.export_dir, encode_settings, args.thumbnail_width, args.workers,
+                                      manifest)
 
-    pack = Pack(name=args.pack_name, cards=nyancards, bundles=bundles)
-    export_pack_json(pack, pack_filename)
-    generate_stats(pack, stats_filename)
-    
+        # Final assembly waits on every stage
+        bundles, compiled = bundles_done.result()
+        nyancards = list(map(NyanCard.from_card, cards))
+
+        pack = Pack(name=args.pack_name, cards=nyancards, bundles=bundles,
+                    bundle_cards={name: sorted(members) for name, members in compiled.members.items()},
+                    card_bundles=compiled.card_bundles)
+        pack_inputs = hash_inputs(pack.model_dump(mode='json', by_alias=True))
+        if not manifest.is_current('pack_json', pack_inputs, pack_filename):
+            with profiling.span('pack json'):
+                export_pack_json(pack, pack_filename)
+            profiling.add_written(pack_filename)
+            manifest.record('pack_json', pack_inputs, pack_filename)
+        if args.since:
+            with profiling.span('pack delta'):
+                export_pack_delta(pack, args.export_dir, args.since, PACK_FILE)
+            delta_filename = os.path.join(args.export_dir, DELTA_FILE)
+            profiling.add_written(delta_filename)
+            # Recorded so a rerun notices if the delta has gone missing
+            manifest.record('pack_delta', hash_inputs(pack_inputs, run_inputs['since']), delta_filename)
+        if args.sharded:
+            shard_dir = os.path.join(args.export_dir, PACK_SHARD_DIR)
+            shard_index = os.path.join(shard_dir, SHARD_INDEX_FILE)
+            shard_inputs = hash_inputs(pack_inputs, args.shard_size)
+            if not manifest.is_current('pack_shards', shard_inputs, shard_index):
+                with profiling.span('pack shards'):
+                    export_pack_shards(pack.name, pack.cards, pack.bundles, shard_dir, args.shard_size)
+                for filename in os.listdir(shard_dir):
+                    profiling.add_written(os.path.join(shard_dir, filename))
+                manifest.record('pack_shards', shard_inputs, shard_index)
+        stats_done.result()
+    if args.stats_db:
+        with profiling.span('stats db'):
+            write_stats_db(pack, args, manifest)
+
+    failed_previews = []
     if args.preview:
-        preview_dir = os.path.join(args.export_dir, "previews")
-        generate_previews(cards, args.export_dir, preview_dir)
+        preview_dir = os.path.join(args.export_dir, PREVIEW_DIR)
+        with profiling.span('previews'):
+            failed_previews = generate_previews(cards, args.export_dir, preview_dir, manifest, args.workers)
+
+    manifest.save(run_inputs)
+    exit_if_previews_failed(failed_previews)
+
+
+def exit_if_previews_failed(failed):
+    if failed:
+        sys.exit(f'{len(failed)} previews failed to render: {", ".join(card.card_name for card in failed)}')
+
+def load_exported_pack(export_dir):
+    from nyan_tcg_game.pack_delta import load_pack
+    try:
+        return load_pack(export_dir, PACK_FILE)
+    except FileNotFoundError:
+        sys.exit(f'No pack has been exported to {export_dir}, run the export command first')
+
+def preview(args):
+    """Renders previews from an exported pack without reading the sheet"""
+    from nyan_tcg_game.build_manifest import BuildManifest
+    from nyan_tcg_game.card_preview import generate_previews
 
+    pack = load_exported_pack(args.export_dir)
+    manifest = BuildManifest(args.export_dir)
+    cards = [card.to_card(IMAGE_DIR) for card in pack.cards]
+    failed = generate_previews(cards, args.export_dir, os.path.join(args.export_dir, PREVIEW_DIR), manifest,
+                               args.workers)
+    manifest.save_partial()
+    exit_if_previews_failed(failed)
 
+def stats(args):
+    """Rewrites the stats of an exported pack without reading the sheet"""
+    from nyan_tcg_game.build_manifest import BuildManifest
+
+    pack = load_exported_pack(args.export_dir)
+    manifest = BuildManifest(args.export_dir)
+    write_pack_stats(pack, os.path.join(args.export_dir, STATS_FILE), manifest)
+    if args.stats_db:
+        write_stats_db(pack, args, manifest)
+    manifest.save_partial()
+
+
+# name: (help, add its arguments, run it)
+COMMANDS = {
+    'download': ('Download the card images into the cache', download_arguments, download),
+    'crop': ('Download and crop the card images', crop_arguments, crop),
+    'export': ('Download, crop and export the whole pack', export_arguments, export),
+    'preview': ('Render card previews of an exported pack', preview_arguments, preview),
+    'stats': ('Write the stats of an exported pack', stats_arguments, stats),
+}
+
+def find_command(argv):
+    """Index of the command in argv, the first argument that is neither a
+    global option nor the value of one, or None if that argument is not a
+    command"""
+    index = 0
+    while index < len(argv):
+        if argv[index] == '--log-level':
+            index += 2
+        elif argv[index].startswith('-'):
+            return None
+        else:
+            return index if argv[index] in COMMANDS else None
+    return None
+
+def get_args(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = find_command(argv)
+    # Without a command the arguments are those of export, as before there
+    # were commands. Export takes --log-level too, so it can go in front.
+    # A lone --help still lists the commands
+    if command is None and argv[:1] not in (['-h'], ['--help']):
+        argv, command = ['export', *argv], 0
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log-level', type=str, default='INFO', help="Sets log level")
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND', required=True)
+    for name, (help, add_arguments, _) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        subparser.add_argument('--log-level', type=str, default=argparse.SUPPRESS, help="Sets log level")
+        # Only the chosen command's arguments are added, as they import
+        # the modules their defaults come from
+        if command is not None and argv[command] == name:
+            add_arguments(subparser)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=args.log_level)
+    #logging.getLogger("nyan_tcg_game.crop_gui").setLevel(logging.DEBUG)
 
+    run = COMMANDS[args.command][2]
+    if not getattr(args, 'profile', False):
+        run(args)
+        return
+    from nyan_tcg_game import profiling
+    profiler = profiling.enable()
+    try:
+        run(args)
+    finally:
+        if not profiler.discarded:
+            os.makedirs(args.export_dir, exist_ok=True)
+            profiler.save(args.export_dir)
+            logger.info(f'Wrote the profile to {os.path.join(args.export_dir, profiling.SUMMARY_FILE)}')
 
 
 if __name__ == '__main__':
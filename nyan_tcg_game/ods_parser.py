@@ -1,18 +1,142 @@
-from pyexcel_ods import get_data
+import pyexcel_ods  # registers the ODS reader with pyexcel_io
+from pyexcel_io import iget_data
+import contextlib
 import itertools
 import logging
 
-from nyan_tcg_game.schemas import BundleType
+from nyan_tcg_game.cards import BundleType
 
 logger = logging.getLogger(__name__)
 
-def read_sheet(filename, sheet_name):
-    data = get_data(filename)
-    try:
-        return data[sheet_name]
-    except KeyError:
-        logger.warn(f"Could not find \"{sheet_name}\" in spreadsheet, returning empty list")
-        return []
+
+class Workbook:
+    """Opens a spreadsheet once and hands out its sheets on demand.
+
+    The underlying file is only parsed the first time a sheet is
+    requested, and each sheet's rows are only read when that sheet is
+    asked for. Sheets are cached so repeated reads are free."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.parse_count = 0
+        self._sheets = None
+        self._reader = None
+        self._cache = {}
+        self._streamed = set()
+
+    def _open(self):
+        if self._sheets is None:
+            logger.debug(f'Parsing {self.filename}')
+            self._sheets, self._reader = iget_data(self.filename)
+            self.parse_count += 1
+        return self._sheets
+
+    def sheet_names(self):
+        return list(self._open().keys())
+
+    def read_sheet(self, sheet_name):
+        if sheet_name not in self._cache:
+            sheets = self._open()
+            try:
+                self._cache[sheet_name] = list(sheets[sheet_name])
+            except KeyError:
+                logger.warn(f"Could not find \"{sheet_name}\" in spreadsheet, returning empty list")
+                self._cache[sheet_name] = []
+        return self._cache[sheet_name]
+
+    def iter_sheet(self, sheet_name):
+        """Yields a sheet's rows straight from the reader without keeping
+        them around. A sheet can only be streamed once per parse, so a
+        second pass over the same sheet re-opens the file"""
+        if sheet_name in self._cache:
+            yield from self._cache[sheet_name]
+            return
+        if sheet_name in self._streamed:
+            logger.debug(f'"{sheet_name}" was already streamed, re-opening {self.filename}')
+            self.close()
+            self._streamed.clear()
+        sheets = self._open()
+        if sheet_name not in sheets:
+            logger.warn(f"Could not find \"{sheet_name}\" in spreadsheet, returning empty list")
+            return
+        self._streamed.add(sheet_name)
+        yield from sheets[sheet_name]
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        self._sheets = None
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@contextlib.contextmanager
+def open_workbook(source):
+    """Yields source unchanged if it is already a Workbook, otherwise
+    opens the named file as one for the duration of the block"""
+    if isinstance(source, Workbook):
+        yield source
+    else:
+        with Workbook(source) as workbook:
+            yield workbook
+
+def read_sheet(source, sheet_name):
+    with open_workbook(source) as workbook:
+        return workbook.read_sheet(sheet_name)
+
+class RowHeader:
+    """Maps a sheet's column names to their index, shared by every row
+    of the sheet. Constants are extra per-sheet values every row reports"""
+    __slots__ = ('columns', 'constants')
+
+    def __init__(self, header_row, constants=None):
+        self.columns = {name: index for index, name in enumerate(header_row)}
+        self.constants = constants or {}
+
+
+class Row:
+    """A compact, read-only view of one spreadsheet row that can be used
+    in place of the dicts built by convert_to_row_dict"""
+    __slots__ = ('header', 'values')
+
+    def __init__(self, header: RowHeader, values):
+        self.header = header
+        self.values = values
+
+    def __getitem__(self, key):
+        try:
+            index = self.header.columns[key]
+        except KeyError:
+            return self.header.constants[key]
+        value = self.values[index] if index < len(self.values) else None
+        return None if value == '' else value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.header.columns or key in self.header.constants
+
+    def __repr__(self):
+        return f'Row({dict((key, self[key]) for key in self.header.columns)})'
+
+
+def iter_rows(data, constants=None):
+    """Lazily converts sheet data into Rows, mapping the header once"""
+    data = iter(data)
+    header_row = next(data, None)
+    if header_row is None:
+        return
+    header = RowHeader(header_row, constants)
+    for values in data:
+        yield Row(header, values)
 
 def convert_to_row_dict(data):
     if data:
@@ -22,18 +146,30 @@ def convert_to_row_dict(data):
         return [dict(itertools.zip_longest(header_row, cleanup_row(row), fillvalue=None)) for row in data[1:]]
     return []
 
-def read_card_data(filename):
-    return convert_to_row_dict(read_sheet(filename, 'Cards'))
+def read_card_data(source):
+    return convert_to_row_dict(read_sheet(source, 'Cards'))
 
-def read_bundle_data(filename, bundle_type: BundleType):
-    if bundle_type == BundleType.CHARACTER:
-        data = read_sheet(filename, 'Character Groups')
-    elif bundle_type == BundleType.CARD:
-        data = read_sheet(filename, 'Card Groups')
-    elif bundle_type == BundleType.BUNDLE:
-        data = read_sheet(filename, 'Bundle Groups')
-    else:
+def iter_card_data(source):
+    with open_workbook(source) as workbook:
+        yield from iter_rows(workbook.iter_sheet('Cards'))
+
+BUNDLE_SHEETS = {
+    BundleType.CHARACTER: 'Character Groups',
+    BundleType.CARD: 'Card Groups',
+    BundleType.BUNDLE: 'Bundle Groups',
+}
+
+def iter_bundle_data(source, bundle_type: BundleType):
+    sheet_name = BUNDLE_SHEETS.get(bundle_type)
+    if sheet_name is None:
+        return
+    with open_workbook(source) as workbook:
+        yield from iter_rows(workbook.iter_sheet(sheet_name), {'bundle_type': bundle_type})
+
+def read_bundle_data(source, bundle_type: BundleType):
+    sheet_name = BUNDLE_SHEETS.get(bundle_type)
+    if sheet_name is None:
         return None
-    data = convert_to_row_dict(data)
+    data = convert_to_row_dict(read_sheet(source, sheet_name))
     data = [{'bundle_type': bundle_type, **d} for d in data]
     return data
@@ -0,0 +1,68 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from nyan_tcg_game.build_manifest import hash_file
+from nyan_tcg_game.downloader import write_atomic
+from nyan_tcg_game.schemas import BundleChanges, CardChanges, ImageChanges, Pack, PackDelta
+
+logger = logging.getLogger(__name__)
+
+DELTA_FILE = 'pack_delta.json'
+
+
+def load_pack(export_dir, pack_file) -> Pack:
+    with open(os.path.join(export_dir, pack_file), 'rb') as f:
+        return Pack.model_validate_json(f.read())
+
+def diff_models(previous, current, changes_type):
+    """Compares two lists of models by name"""
+    previous = {model.name: model for model in previous}
+    current = {model.name: model for model in current}
+    return changes_type(
+        added=[model for name, model in current.items() if name not in previous],
+        modified=[model for name, model in current.items() if name in previous and model != previous[name]],
+        removed=[name for name in previous if name not in current])
+
+def image_paths(pack: Pack):
+    paths = set()
+    for card in pack.cards:
+        if card.image_url:
+            paths.add(card.image_url)
+        paths.update(thumbnail.url for thumbnail in card.thumbnails)
+    return paths
+
+def hash_or_none(filename):
+    return hash_file(filename) if filename and os.path.exists(filename) else None
+
+def diff_images(previous: Pack, previous_dir, current: Pack, current_dir, workers=None):
+    """Finds the image files of current that are new or whose content
+    differs from the file at the same path in previous"""
+    previous_paths = image_paths(previous)
+    current_paths = sorted(image_paths(current))
+    with ThreadPoolExecutor(workers) as executor:
+        current_hashes = executor.map(hash_or_none, (os.path.join(current_dir, path) for path in current_paths))
+        previous_hashes = executor.map(hash_or_none, (os.path.join(previous_dir, path) if path in previous_paths
+                                                      else None for path in current_paths))
+        changed = [path for path, current_hash, previous_hash in zip(current_paths, current_hashes, previous_hashes)
+                   if current_hash is not None and current_hash != previous_hash]
+    return ImageChanges(changed=changed, removed=sorted(previous_paths.difference(current_paths)))
+
+
+def export_pack_delta(pack: Pack, export_dir, previous_dir, pack_file, output_filename=None) -> PackDelta:
+    """Writes the difference between pack and the pack previously exported
+    to previous_dir: the cards and bundles added, modified and removed,
+    and the image files that are new or have changed"""
+    previous = load_pack(previous_dir, pack_file)
+    delta = PackDelta(name=pack.name,
+                      since=previous.name,
+                      cards=diff_models(previous.cards, pack.cards, CardChanges),
+                      bundles=diff_models(previous.bundles, pack.bundles, BundleChanges),
+                      images=diff_images(previous, previous_dir, pack, export_dir))
+    output_filename = output_filename or os.path.join(export_dir, DELTA_FILE)
+    write_atomic(output_filename, delta.model_dump_json(indent=2, by_alias=True).encode('utf-8'))
+    logger.info(f'Changes since {previous.name}: '
+                f'cards +{len(delta.cards.added)} ~{len(delta.cards.modified)} -{len(delta.cards.removed)}, '
+                f'bundles +{len(delta.bundles.added)} ~{len(delta.bundles.modified)} -{len(delta.bundles.removed)}, '
+                f'images {len(delta.images.changed)} changed {len(delta.images.removed)} removed')
+    return delta
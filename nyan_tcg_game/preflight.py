@@ -0,0 +1,195 @@
+import collections
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict, field
+
+import nyan_tcg_game.ods_parser as ods_parser
+from nyan_tcg_game.bundles import BundleEntry
+from nyan_tcg_game.cards import BundleType, Rarity, image_filename
+from nyan_tcg_game.downloader import Downloader, write_atomic
+
+logger = logging.getLogger(__name__)
+
+PREFLIGHT_FILE = 'preflight.json'
+ERROR = 'error'
+WARNING = 'warning'
+
+
+@dataclass
+class Issue:
+    severity: str
+    check: str
+    message: str
+    sheet: str | None = None
+    # Counting the header as row 1, as spreadsheet programs show it
+    row: int | None = None
+    card: str | None = None
+
+
+@dataclass
+class PreflightReport:
+    sheet: str
+    num_cards: int = 0
+    num_uris: int = 0
+    issues: list[Issue] = field(default_factory=list)
+
+    def add(self, severity, check, message, **where):
+        self.issues.append(Issue(severity, check, message, **where))
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.severity == ERROR]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue.severity == WARNING]
+
+    def save(self, filename):
+        data = {**asdict(self), 'num_errors': len(self.errors), 'num_warnings': len(self.warnings)}
+        write_atomic(filename, json.dumps(data, indent=2).encode('utf-8'))
+
+
+@dataclass
+class SheetCard:
+    """The parts of a card row the checks need, read without building a
+    Card so that rows a Card would reject can be reported"""
+    row: int
+    name: str
+    variant: str | None
+    rarity: str
+    uri: str | None
+
+    @property
+    def card_name(self):
+        return f'{self.name} ({self.variant})' if self.variant else self.name
+
+
+def read_sheet_cards(workbook, report):
+    cards = []
+    for index, row in enumerate(ods_parser.iter_rows(workbook.read_sheet('Cards'))):
+        # Rows without a rarity are not cards, as in dict_to_card
+        if not row.get('Rarity'):
+            continue
+        cards.append(SheetCard(index + 2, str(row.get('Name') or '').strip(), row.get('Variant'),
+                               row['Rarity'], row.get('File URI')))
+    report.num_cards = len(cards)
+    return cards
+
+
+def check_cards(cards, report):
+    rarities = {rarity.value for rarity in Rarity}
+    by_filename = collections.defaultdict(list)
+    for card in cards:
+        where = {'sheet': 'Cards', 'row': card.row, 'card': card.card_name}
+        if not card.name:
+            report.add(ERROR, 'name', 'Card has no name', **where)
+        if card.rarity not in rarities:
+            report.add(ERROR, 'rarity', f'Unknown rarity "{card.rarity}", expected one of {sorted(rarities)}',
+                       **where)
+        if not card.uri:
+            report.add(ERROR, 'uri', 'Card has no File URI', **where)
+        by_filename[image_filename(card.name, card.variant, '')].append(card)
+
+    for filename, same in by_filename.items():
+        if len(same) > 1:
+            rows = ', '.join(str(card.row) for card in same)
+            for card in same:
+                report.add(ERROR, 'filename', f'Cards on rows {rows} would all write images named "{filename}"',
+                           sheet='Cards', row=card.row, card=card.card_name)
+
+def check_duplicate_uris(cards, report):
+    by_uri = collections.defaultdict(list)
+    for card in cards:
+        if card.uri:
+            by_uri[card.uri].append(card)
+    for uri, same in by_uri.items():
+        if len(same) > 1:
+            names = ', '.join(card.card_name for card in same)
+            for card in same:
+                report.add(WARNING, 'duplicate_uri', f'{uri} is used by {len(same)} cards: {names}',
+                           sheet='Cards', row=card.row, card=card.card_name)
+
+
+def check_bundles(workbook, cards, report):
+    """Reports group rows that refer to cards, characters or groups the
+    sheet does not have, which parse_bundles would silently leave out"""
+    card_names = {card.card_name for card in cards}
+    characters = {card.name for card in cards}
+    entries = []
+    for bundle_type, sheet_name in ods_parser.BUNDLE_SHEETS.items():
+        for index, row in enumerate(ods_parser.iter_rows(workbook.read_sheet(sheet_name),
+                                                         {'bundle_type': bundle_type})):
+            if not row.get('Group Name') or not row.get('Name'):
+                continue
+            entries.append((sheet_name, index + 2, BundleEntry.parse_dict(row)))
+    bundle_names = {entry.bundle_name for _, _, entry in entries}
+
+    for sheet_name, row, entry in entries:
+        where = {'sheet': sheet_name, 'row': row}
+        if entry.bundle_type == BundleType.CARD and entry.card_name not in card_names:
+            report.add(ERROR, 'bundle_reference', f'"{entry.bundle_name}" refers to a card "{entry.card_name}" '
+                       'that is not in the Cards sheet', **where)
+        elif entry.bundle_type == BundleType.CHARACTER and entry.name not in characters:
+            report.add(ERROR, 'bundle_reference', f'"{entry.bundle_name}" refers to a character "{entry.name}" '
+                       'with no cards', **where)
+        elif entry.bundle_type == BundleType.BUNDLE and entry.name not in bundle_names:
+            report.add(ERROR, 'bundle_reference', f'"{entry.bundle_name}" refers to a group "{entry.name}" '
+                       'that is not defined', **where)
+
+
+def finish_probe(uri, future, cards, report):
+    try:
+        result = future.result()
+    except Exception as e:
+        severity, message = ERROR, f'Could not reach {uri}: {e}'
+    else:
+        if not result.ok and uri.startswith('file:'):
+            severity, message = ERROR, f'{uri} does not exist'
+        elif not result.ok:
+            severity, message = ERROR, f'{uri} returned {result.status}'
+        elif result.content_type and not result.content_type.startswith('image/'):
+            severity, message = WARNING, f'{uri} is {result.content_type}, not an image'
+        else:
+            return
+    for card in cards:
+        report.add(severity, 'uri', message, sheet='Cards', row=card.row, card=card.card_name)
+
+
+def run_preflight(sheet, downloader: Downloader) -> PreflightReport:
+    """Checks the whole sheet before anything is downloaded. Every File URI
+    is probed on the downloader while the sheet's own checks run"""
+    report = PreflightReport(sheet)
+    with ods_parser.Workbook(sheet) as workbook:
+        cards = read_sheet_cards(workbook, report)
+        by_uri = collections.defaultdict(list)
+        for card in cards:
+            if card.uri:
+                by_uri[card.uri].append(card)
+        report.num_uris = len(by_uri)
+        probes = {uri: downloader.submit_probe(uri) for uri in by_uri}
+
+        check_cards(cards, report)
+        check_duplicate_uris(cards, report)
+        check_bundles(workbook, cards, report)
+    for uri, future in probes.items():
+        finish_probe(uri, future, by_uri[uri], report)
+    return report
+
+def log_report(report: PreflightReport, filename):
+    for issue in report.issues:
+        where = f'{issue.sheet} row {issue.row}: ' if issue.row else ''
+        log = logger.error if issue.severity == ERROR else logger.warning
+        log(f'{where}{issue.message}')
+    logger.info(f'Preflight checked {report.num_cards} cards and {report.num_uris} URIs: '
+                f'{len(report.errors)} errors, {len(report.warnings)} warnings, see {filename}')
+
+def preflight(sheet, downloader: Downloader, report_dir) -> bool:
+    """Runs the checks and writes the report to report_dir. Returns False
+    if the sheet has errors"""
+    report = run_preflight(sheet, downloader)
+    os.makedirs(report_dir, exist_ok=True)
+    filename = os.path.join(report_dir, PREFLIGHT_FILE)
+    report.save(filename)
+    log_report(report, filename)
+    return not report.errors
@@ -0,0 +1,225 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out of the profile there
+    resource = None
+
+TRACE_FILE = 'profile_trace.json'
+SUMMARY_FILE = 'profile_summary.txt'
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its largest
+    finished child process, such as a pool worker"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+def process_cpu_ns():
+    """CPU time of this process and of its finished child processes"""
+    cpu = time.process_time_ns()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += int((children.ru_utime + children.ru_stime) * 1e9)
+    return cpu
+
+
+def _timed_call(fn, args):
+    """Runs fn in a worker process, returning its result with when it ran"""
+    start, cpu = time.perf_counter_ns(), time.thread_time_ns()
+    result = fn(*args)
+    return result, start, time.perf_counter_ns(), time.thread_time_ns() - cpu, os.getpid()
+
+
+class Profiler:
+    """Collects timed spans and byte counts for one export run.
+
+    Stage spans time a whole step of the export. A stage on the main thread
+    counts the CPU time of the whole process and its worker processes while
+    it ran, one on a background thread only that thread's. Card spans time
+    one card within a stage, with the CPU time of the thread or worker that
+    handled it. Times come from perf_counter, which is shared
+    by the worker processes on Linux so their spans line up in the trace"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.spans = []
+        self.bytes = collections.Counter()
+        self.rss = []
+        # Set by discard for runs that had nothing to do, so they leave the
+        # previous run's profile in place
+        self.discarded = False
+
+    def add_span(self, name, category, start_ns, end_ns, cpu_ns=None, pid=None, tid=None, **args):
+        span = {'name': name, 'cat': category, 'start': start_ns, 'end': end_ns, 'cpu': cpu_ns,
+                'pid': pid or os.getpid(), 'tid': tid or threading.get_native_id(), 'args': args}
+        with self.lock:
+            self.spans.append(span)
+
+    @contextlib.contextmanager
+    def span(self, name, category='stage', **args):
+        process = category == 'stage' and threading.current_thread() is threading.main_thread()
+        start = time.perf_counter_ns()
+        cpu = process_cpu_ns() if process else time.thread_time_ns()
+        try:
+            yield
+        finally:
+            cpu = (process_cpu_ns() if process else time.thread_time_ns()) - cpu
+            end = time.perf_counter_ns()
+            self.add_span(name, category, start, end, cpu, **args)
+            if category == 'stage':
+                self.sample_rss(end)
+
+    def add_bytes(self, counter, num_bytes):
+        with self.lock:
+            self.bytes[counter] += num_bytes
+
+    def sample_rss(self, at_ns=None):
+        rss, children_rss = peak_rss()
+        if rss is not None:
+            with self.lock:
+                self.rss.append((at_ns or time.perf_counter_ns(), rss, children_rss))
+
+    def trace_events(self):
+        """The spans as Chrome trace events, viewable in chrome://tracing
+        or Perfetto"""
+        def us(ns):
+            return (ns - self.origin) / 1000
+        events = []
+        threads = set()
+        for span in self.spans:
+            args = dict(span['args'])
+            if span['cpu'] is not None:
+                args['cpu_ms'] = round(span['cpu'] / 1e6, 3)
+            events.append({'name': span['name'], 'cat': span['cat'], 'ph': 'X',
+                           'ts': us(span['start']), 'dur': (span['end'] - span['start']) / 1000,
+                           'pid': span['pid'], 'tid': span['tid'], 'args': args})
+            threads.add((span['pid'], span['tid']))
+        main_pid = os.getpid()
+        for pid, tid in sorted(threads):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': 'export' if pid == main_pid else f'worker {pid}'}})
+        for at, rss, children_rss in self.rss:
+            events.append({'name': 'peak_rss', 'ph': 'C', 'ts': us(at), 'pid': main_pid,
+                           'args': {'export': rss, 'largest worker': children_rss}})
+        return events
+
+    def write_trace(self, filename):
+        from nyan_tcg_game.downloader import write_atomic
+        with self.lock:
+            trace = {'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                     'otherData': {'bytes': dict(self.bytes)}}
+        write_atomic(filename, json.dumps(trace).encode())
+
+    def write_summary(self, fp):
+        # Only needed once a profile is written, every module imports this one
+        from prettytable import PrettyTable
+        from nyan_tcg_game.downloader import format_bytes
+        with self.lock:
+            spans = list(self.spans)
+            byte_counts = dict(self.bytes)
+
+        fp.write('Stages:\n')
+        table = PrettyTable()
+        table.field_names = ['Stage', 'Wall (s)', 'CPU (s)', 'Start (s)']
+        for span in sorted((s for s in spans if s['cat'] == 'stage'), key=lambda s: s['start']):
+            table.add_row((span['name'], f"{(span['end'] - span['start']) / 1e9:.2f}",
+                           f"{span['cpu'] / 1e9:.2f}", f"{(span['start'] - self.origin) / 1e9:.2f}"))
+        fp.write(str(table))
+        fp.write('\n\n')
+
+        by_category = collections.defaultdict(list)
+        for span in spans:
+            if span['cat'] != 'stage':
+                by_category[span['cat']].append(span)
+        fp.write('Per card:\n')
+        table = PrettyTable()
+        table.field_names = ['Step', 'Cards', 'Wall total (s)', 'Wall mean (ms)', 'CPU mean (ms)',
+                             'Slowest', 'Slowest (ms)']
+        for category, category_spans in sorted(by_category.items()):
+            walls = [span['end'] - span['start'] for span in category_spans]
+            cpus = [span['cpu'] for span in category_spans if span['cpu'] is not None]
+            slowest = max(category_spans, key=lambda span: span['end'] - span['start'])
+            table.add_row((category, len(category_spans), f'{sum(walls) / 1e9:.2f}',
+                           f'{sum(walls) / len(walls) / 1e6:.1f}',
+                           f'{sum(cpus) / len(cpus) / 1e6:.1f}' if cpus else '-',
+                           slowest['name'], f"{(slowest['end'] - slowest['start']) / 1e6:.1f}"))
+        fp.write(str(table))
+        fp.write('\n\n')
+
+        for counter, num_bytes in sorted(byte_counts.items()):
+            fp.write(f'Bytes {counter}: {format_bytes(num_bytes)}\n')
+        rss, children_rss = peak_rss()
+        if rss is not None:
+            fp.write(f'Peak RSS: {format_bytes(rss)}, largest worker process {format_bytes(children_rss)}\n')
+
+    def save(self, export_dir):
+        self.sample_rss()
+        self.write_trace(os.path.join(export_dir, TRACE_FILE))
+        with open(os.path.join(export_dir, SUMMARY_FILE), 'w') as f:
+            self.write_summary(f)
+
+
+# The profiler of the current run, None unless --profile was given. The
+# hooks below do nothing without one
+active = None
+
+def enable() -> Profiler:
+    global active
+    active = Profiler()
+    return active
+
+def discard():
+    """Keeps this run's profile from being saved"""
+    if active is not None:
+        active.discarded = True
+
+def span(name, category='stage', **args):
+    """Times the enclosed block as a stage, or as a card within a stage
+    when given another category"""
+    if active is None:
+        return contextlib.nullcontext()
+    return active.span(name, category, **args)
+
+def add_span(name, category, start_ns, end_ns, cpu_ns=None, **args):
+    if active is not None:
+        active.add_span(name, category, start_ns, end_ns, cpu_ns, **args)
+
+def add_bytes(counter, num_bytes):
+    if active is not None:
+        active.add_bytes(counter, num_bytes)
+
+def add_written(filename):
+    """Counts a file written by the export towards the bytes written"""
+    if active is not None:
+        active.add_bytes('written', os.path.getsize(filename))
+
+def submit(executor, name, category, fn, *args):
+    """Submits fn to a process pool like executor.submit, recording a card
+    span for it with the time and CPU it took in its worker"""
+    if active is None:
+        return executor.submit(fn, *args)
+    profiler = active
+    future = Future()
+
+    def finish(timed):
+        try:
+            result, start, end, cpu, pid = timed.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        profiler.add_span(name, category, start, end, cpu, pid=pid, tid=pid)
+        future.set_result(result)
+
+    executor.submit(_timed_call, fn, args).add_done_callback(finish)
+    return future
@@ -1,13 +1,22 @@
+import os
+
 from pydantic import BaseModel, Field, ConfigDict
-from enum import Enum
-from nyan_tcg_game.cards import Card, Rarity
+from nyan_tcg_game.cards import BundleType, Card, Rarity
    
 
+class Thumbnail(BaseModel):
+    width: int
+    height: int
+    url: str
+
+
 class NyanCard(BaseModel):
     name: str
     subtext: str | None
     character: str | None
     image_url: str | None
+    # Smaller copies of image_url, smallest first
+    thumbnails: list[Thumbnail] = []
     image_credit: str | None
     image_source: str | None
     rarity: Rarity
@@ -19,15 +28,23 @@ class NyanCard(BaseModel):
             subtext=card.company,
             character=card.character,
             rarity=card.rarity,
-            image_url=card.resized_uri,
+            image_url=card.export_uri or card.resized_uri,
+            thumbnails=[Thumbnail(width=width, height=height, url=url)
+                        for width, height, url in card.thumbnails or []],
             image_credit=card.image_credit,
             image_source=card.source_url)
 
+    def to_card(self, image_dir) -> Card:
+        """The Card this was exported from, as far as the pack records
+        it, pointed at its cropped image in image_dir"""
+        card = Card(name=self.name, variant=None, character=self.character, company=self.subtext,
+                    rarity=self.rarity, image_credit=self.image_credit, source_url=self.image_source,
+                    image_file_uri=None, local_image_path=None, resized_uri=None,
+                    background_fill=(255, 255, 255, 0))
+        # name already includes the variant, which gives the same filename
+        card.resized_uri = os.path.join(image_dir, card.get_image_filename('.png'))
+        return card
 
-class BundleType(str, Enum):
-    CHARACTER = 'character'
-    CARD = 'card'
-    BUNDLE = 'bundle'
 
 class Bundle(BaseModel):
     name: str
@@ -42,3 +59,29 @@ class Pack(BaseModel):
     name: str
     cards: list[NyanCard]
     bundles: list[Bundle]
+    # Every card in each bundle with sub-bundles resolved, and the reverse
+    bundle_cards: dict[str, list[str]] = {}
+    card_bundles: dict[str, list[str]] = {}
+
+
+class CardChanges(BaseModel):
+    added: list[NyanCard] = []
+    modified: list[NyanCard] = []
+    removed: list[str] = []
+
+class BundleChanges(BaseModel):
+    added: list[Bundle] = []
+    modified: list[Bundle] = []
+    removed: list[str] = []
+
+class ImageChanges(BaseModel):
+    # Paths relative to the export directory
+    changed: list[str] = []
+    removed: list[str] = []
+
+class PackDelta(BaseModel):
+    name: str
+    since: str
+    cards: CardChanges
+    bundles: BundleChanges
+    images: ImageChanges
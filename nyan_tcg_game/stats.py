@@ -1,11 +1,11 @@
+import contextlib
 import sqlite3
 from nyan_tcg_game.schemas import Pack
+from nyan_tcg_game import profiling
 from prettytable import PrettyTable
 
-db = sqlite3.connect(":memory:")
-#db = sqlite3.connect("stats.db")
 
-def create_db():
+def create_db(db):
     db.execute('CREATE TABLE cards (name text, character text, subtext text, rarity text);')
     db.execute('CREATE TABLE bundles (bundle_name text PRIMARY KEY);')
     db.execute('''CREATE TABLE card_bundles (bundle_name text, card_name text,
@@ -15,30 +15,50 @@ def create_db():
     FOREIGN KEY(bundle_name) REFERENCES bundles(bundle_name),
     FOREIGN KEY(character_name) REFERENCES cards(character));''')
     db.execute('CREATE VIEW characters(character) AS SELECT DISTINCT(character) FROM cards;')
-def populate_db(pack: Pack):
+
+def create_indexes(db):
+    # Built after the bulk insert, which is faster than keeping them up
+    # to date row by row
+    with db:
+        db.execute('CREATE INDEX IF NOT EXISTS cards_character ON cards (character);')
+        db.execute('CREATE INDEX IF NOT EXISTS cards_name ON cards (name);')
+        db.execute('CREATE INDEX IF NOT EXISTS card_bundles_card ON card_bundles (card_name, bundle_name);')
+        db.execute('''CREATE INDEX IF NOT EXISTS character_bundles_character
+        ON character_bundles (character_name, bundle_name);''')
+
+def populate_db(db, pack: Pack):
     with db:
         db.executemany('INSERT INTO cards (name, character, subtext, rarity) VALUES (?, ?, ?, ?);',
                     [(card.name, card.character, card.subtext, card.rarity) for card in pack.cards])
-        for bundle in pack.bundles:
-            db.execute('INSERT INTO bundles (bundle_name) VALUES (?);', (bundle.name, ))
-            db.executemany('INSERT INTO card_bundles (bundle_name, card_name) VALUES (?, ?);',
-                        [(bundle.name, card) for card in bundle.cards])
-            db.executemany('INSERT INTO character_bundles (bundle_name, character_name) VALUES (?, ?);',
-                        [(bundle.name, character) for character in bundle.characters])
+        db.executemany('INSERT INTO bundles (bundle_name) VALUES (?);',
+                       ((bundle.name, ) for bundle in pack.bundles))
+        db.executemany('INSERT INTO card_bundles (bundle_name, card_name) VALUES (?, ?);',
+                       ((bundle.name, card) for bundle in pack.bundles for card in bundle.cards))
+        db.executemany('INSERT INTO character_bundles (bundle_name, character_name) VALUES (?, ?);',
+                       ((bundle.name, character) for bundle in pack.bundles for character in bundle.characters))
     
 
-def print_bundle_membership(stats_fp):
+def print_bundle_membership(db, stats_fp):
+    # Each kind of bundle is counted per character on its own before
+    # joining, joining both at once multiplies every character bundle by
+    # every card bundle of the character
     results = db.execute('''
+    WITH character_counts AS (
+        SELECT character_name, COUNT(DISTINCT bundle_name) AS num_bundles
+        FROM character_bundles GROUP BY character_name),
+    card_counts AS (
+        SELECT cards.character, COUNT(DISTINCT card_bundles.bundle_name) AS num_bundles
+        FROM cards JOIN card_bundles ON cards.name = card_bundles.card_name
+        GROUP BY cards.character)
     SELECT characters.character as character,
-       COUNT(DISTINCT character_bundles.bundle_name) + COUNT(DISTINCT card_bundles.bundle_name) as total_bundles,
-       COUNT(DISTINCT character_bundles.bundle_name) as num_character_bundles,
-       COUNT(DISTINCT card_bundles.bundle_name) as num_card_bundles
+       COALESCE(character_counts.num_bundles, 0) + COALESCE(card_counts.num_bundles, 0) as total_bundles,
+       COALESCE(character_counts.num_bundles, 0) as num_character_bundles,
+       COALESCE(card_counts.num_bundles, 0) as num_card_bundles
     FROM characters
-        LEFT JOIN character_bundles ON characters.character = character_bundles.character_name
-        LEFT JOIN cards ON cards.character = characters.character
-        LEFT JOIN card_bundles ON cards.name = card_bundles.card_name
-    WHERE cards.character IS NOT NULL
-    GROUP BY characters.character ;
+        LEFT JOIN character_counts ON characters.character = character_counts.character_name
+        LEFT JOIN card_counts ON characters.character = card_counts.character
+    WHERE characters.character IS NOT NULL
+    ORDER BY characters.character;
     ''').fetchall()
     stats_fp.write('Number of bundles per character:\n')
     table = PrettyTable()
@@ -49,16 +69,17 @@ def print_bundle_membership(stats_fp):
     stats_fp.write(str(table))
     stats_fp.write('\n')
 
-def print_character_rarities(stats_fp):
+def print_character_rarities(db, stats_fp):
+    # Every character has at least one card, so grouping the cards
+    # directly gives the same rows as going through the characters view
     results = db.execute('''
-    SELECT ch.character,
-    SUM(CASE WHEN ca.rarity = 'Common' THEN 1 ELSE 0 END) as common_count,
-    SUM(CASE WHEN ca.rarity = 'Rare' THEN 1 ELSE 0 END) as rare_count,
-    SUM(CASE WHEN ca.rarity = 'Special Rare' THEN 1 ELSE 0 END) as special_rare_count
-    FROM characters ch
-    LEFT JOIN cards ca ON ca.character = ch.character
-    WHERE ch.character IS NOT NULL
-    GROUP BY ch.character ORDER BY ch.character''').fetchall()
+    SELECT character,
+    SUM(CASE WHEN rarity = 'Common' THEN 1 ELSE 0 END) as common_count,
+    SUM(CASE WHEN rarity = 'Rare' THEN 1 ELSE 0 END) as rare_count,
+    SUM(CASE WHEN rarity = 'Special Rare' THEN 1 ELSE 0 END) as special_rare_count
+    FROM cards
+    WHERE character IS NOT NULL
+    GROUP BY character ORDER BY character''').fetchall()
     stats_fp.write('Rarities per character:\n')
     table = PrettyTable()
     table.field_names = ["Character Name", "C", "R", "SR", "Attn"]
@@ -68,7 +89,7 @@ def print_character_rarities(stats_fp):
     stats_fp.write(str(table))
     stats_fp.write('\n')
     
-def print_subtexts(stats_fp):
+def print_subtexts(db, stats_fp):
     results = db.execute('''
     SELECT cards.subtext, COUNT(DISTINCT cards.character), COUNT(*) FROM cards
     WHERE cards.subtext IS NOT NULL
@@ -82,7 +103,7 @@ def print_subtexts(stats_fp):
     stats_fp.write(str(table))
     stats_fp.write('\n')
 
-def print_totals(stats_fp):
+def print_totals(db, stats_fp):
     results = db.execute('''
     SELECT COUNT(*), COUNT(DISTINCT cards.character) FROM cards;''').fetchone()
     bundle_results = db.execute('''
@@ -98,14 +119,23 @@ def print_totals(stats_fp):
     stats_fp.write("\n")
     
 
+def write_stats(db, stats_fp):
+    print_bundle_membership(db, stats_fp)
+    stats_fp.write('\n\n')
+    print_character_rarities(db, stats_fp)
+    stats_fp.write('\n\n')
+    print_subtexts(db, stats_fp)
+    stats_fp.write('\n\n')
+    print_totals(db, stats_fp)
+
 def generate_stats(pack: Pack, stats_file: str):
-    create_db()
-    populate_db(pack)
-    with open(stats_file, 'w') as f:
-        print_bundle_membership(f)
-        f.write('\n\n')
-        print_character_rarities(f)
-        f.write('\n\n')
-        print_subtexts(f)
-        f.write('\n\n')
-        print_totals(f)
+    # A fresh database for every call, so stats can be generated for more
+    # than one pack in the same process
+    with contextlib.closing(sqlite3.connect(":memory:")) as db:
+        with profiling.span('stats populate'):
+            create_db(db)
+            populate_db(db, pack)
+            create_indexes(db)
+        with profiling.span('stats queries'), open(stats_file, 'w') as f:
+            write_stats(db, f)
+    profiling.add_written(stats_file)
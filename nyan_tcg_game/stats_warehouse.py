@@ -0,0 +1,206 @@
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+
+from prettytable import PrettyTable
+
+from nyan_tcg_game.build_manifest import hash_inputs
+from nyan_tcg_game.schemas import Pack
+import nyan_tcg_game.stats as stats
+
+logger = logging.getLogger(__name__)
+
+TRENDS_FILE = 'pack_trends.txt'
+
+
+def pack_hash(pack: Pack):
+    return hash_inputs(pack.model_dump(mode='json', by_alias=True))
+
+def default_edition(pack: Pack, pack_id):
+    """Names an edition after the pack when the editions are grouped by a
+    separate pack id, otherwise by its content"""
+    return pack.name if pack_id != pack.name else pack_hash(pack)[:12]
+
+
+class StatsWarehouse:
+    """On-disk store of the stats tables of every pack edition ingested.
+
+    Editions are grouped by a pack id that stays the same from edition to
+    edition, the pack's name unless another is given. Each table of the
+    in-memory stats database has an edition_ table here with an edition_id
+    column. For one edition, temporary views named like the in-memory
+    tables select its rows, so the queries in stats answer for any edition
+    as they do for a single pack"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.db:
+            editions_table = '''(
+                id integer PRIMARY KEY, pack_id text, pack_name text, edition text, pack_hash text,
+                ingested_at real, UNIQUE(pack_id, edition));'''
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(editions);')]
+            if columns and 'pack_id' not in columns:
+                # Databases from before pack ids grouped editions by name,
+                # the table is rebuilt to change its unique key
+                self.db.execute(f'CREATE TABLE editions_by_id {editions_table}')
+                self.db.execute('''INSERT INTO editions_by_id (id, pack_id, pack_name, edition, pack_hash, ingested_at)
+                SELECT id, pack_name, pack_name, edition, pack_hash, ingested_at FROM editions;''')
+                self.db.execute('DROP TABLE editions;')
+                self.db.execute('ALTER TABLE editions_by_id RENAME TO editions;')
+            self.db.execute(f'CREATE TABLE IF NOT EXISTS editions {editions_table}')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS edition_cards (
+                edition_id integer, name text, character text, subtext text, rarity text,
+                FOREIGN KEY(edition_id) REFERENCES editions(id));''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS edition_bundles (
+                edition_id integer, bundle_name text,
+                FOREIGN KEY(edition_id) REFERENCES editions(id));''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS edition_card_bundles (
+                edition_id integer, bundle_name text, card_name text,
+                FOREIGN KEY(edition_id) REFERENCES editions(id));''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS edition_character_bundles (
+                edition_id integer, bundle_name text, character_name text,
+                FOREIGN KEY(edition_id) REFERENCES editions(id));''')
+            # Every query is restricted to a single edition first
+            self.db.execute('CREATE INDEX IF NOT EXISTS edition_cards_character ON edition_cards (edition_id, character);')
+            self.db.execute('CREATE INDEX IF NOT EXISTS edition_cards_name ON edition_cards (edition_id, name);')
+            self.db.execute('CREATE INDEX IF NOT EXISTS edition_bundles_edition ON edition_bundles (edition_id);')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS edition_card_bundles_card
+            ON edition_card_bundles (edition_id, card_name, bundle_name);''')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS edition_character_bundles_character
+            ON edition_character_bundles (edition_id, character_name, bundle_name);''')
+
+    def edition_id(self, pack_id, edition):
+        row = self.db.execute('SELECT id FROM editions WHERE pack_id = ? AND edition = ?;',
+                              (pack_id, edition)).fetchone()
+        return row and row[0]
+
+    def latest_edition(self, pack_id):
+        row = self.db.execute('SELECT edition FROM editions WHERE pack_id = ? ORDER BY id DESC LIMIT 1;',
+                              (pack_id, )).fetchone()
+        return row and row[0]
+
+    def ingest(self, pack: Pack, edition=None, pack_id=None) -> bool:
+        """Stores the stats tables of pack as one edition of pack_id.
+        Returns False without touching the database if that edition is
+        already stored"""
+        pack_id = pack_id or pack.name
+        edition = edition or default_edition(pack, pack_id)
+        if self.edition_id(pack_id, edition) is not None:
+            logger.info(f'Edition {edition} of {pack_id} is already in {self.filename}')
+            return False
+        with self.db:
+            edition_id = self.db.execute('''INSERT INTO editions (pack_id, pack_name, edition, pack_hash, ingested_at)
+            VALUES (?, ?, ?, ?, ?);''', (pack_id, pack.name, edition, pack_hash(pack), time.time())).lastrowid
+            self.db.executemany('INSERT INTO edition_cards (edition_id, name, character, subtext, rarity) VALUES (?, ?, ?, ?, ?);',
+                                ((edition_id, card.name, card.character, card.subtext, card.rarity)
+                                 for card in pack.cards))
+            self.db.executemany('INSERT INTO edition_bundles (edition_id, bundle_name) VALUES (?, ?);',
+                                ((edition_id, bundle.name) for bundle in pack.bundles))
+            self.db.executemany('INSERT INTO edition_card_bundles (edition_id, bundle_name, card_name) VALUES (?, ?, ?);',
+                                ((edition_id, bundle.name, card) for bundle in pack.bundles for card in bundle.cards))
+            self.db.executemany('''INSERT INTO edition_character_bundles (edition_id, bundle_name, character_name)
+            VALUES (?, ?, ?);''', ((edition_id, bundle.name, character)
+                                   for bundle in pack.bundles for character in bundle.characters))
+        logger.info(f'Ingested edition {edition} of {pack_id} into {self.filename}')
+        return True
+
+    def select_edition(self, pack_id, edition):
+        """Points the cards, bundles, card_bundles, character_bundles and
+        characters views at one edition"""
+        edition_id = self.edition_id(pack_id, edition)
+        if edition_id is None:
+            raise KeyError(f'Edition {edition} of {pack_id} has not been ingested')
+        views = {
+            'cards': 'SELECT name, character, subtext, rarity FROM edition_cards',
+            'bundles': 'SELECT bundle_name FROM edition_bundles',
+            'card_bundles': 'SELECT bundle_name, card_name FROM edition_card_bundles',
+            'character_bundles': 'SELECT bundle_name, character_name FROM edition_character_bundles',
+        }
+        with self.db:
+            self.db.execute('DROP VIEW IF EXISTS temp.characters;')
+            for name, query in views.items():
+                self.db.execute(f'DROP VIEW IF EXISTS temp.{name};')
+                # edition_id is an integer from the editions table
+                self.db.execute(f'CREATE TEMP VIEW {name} AS {query} WHERE edition_id = {int(edition_id)};')
+            self.db.execute('CREATE TEMP VIEW characters(character) AS SELECT DISTINCT(character) FROM cards;')
+
+    def write_edition_stats(self, pack_id, edition, stats_fp):
+        """Writes the same tables as pack_stats.txt for a stored edition"""
+        self.select_edition(pack_id, edition)
+        stats.write_stats(self.db, stats_fp)
+
+    def print_trends(self, pack_id, stats_fp):
+        """Writes how the pack's totals changed from edition to edition"""
+        results = self.db.execute('''
+        WITH card_totals AS (
+            SELECT edition_id, COUNT(*) AS num_cards, COUNT(DISTINCT character) AS num_characters,
+               SUM(CASE WHEN rarity = 'Common' THEN 1 ELSE 0 END) AS common_count,
+               SUM(CASE WHEN rarity = 'Rare' THEN 1 ELSE 0 END) AS rare_count,
+               SUM(CASE WHEN rarity = 'Special Rare' THEN 1 ELSE 0 END) AS special_rare_count
+            FROM edition_cards GROUP BY edition_id),
+        bundle_totals AS (
+            SELECT edition_id, COUNT(*) AS num_bundles FROM edition_bundles GROUP BY edition_id),
+        covered AS (
+            SELECT edition_id, COUNT(DISTINCT character_name) AS num_covered
+            FROM edition_character_bundles GROUP BY edition_id)
+        SELECT editions.edition, editions.pack_name,
+           COALESCE(num_cards, 0),
+           COALESCE(num_cards, 0) - LAG(COALESCE(num_cards, 0)) OVER (ORDER BY editions.id),
+           COALESCE(num_characters, 0),
+           COALESCE(num_bundles, 0),
+           COALESCE(common_count, 0), COALESCE(rare_count, 0), COALESCE(special_rare_count, 0),
+           COALESCE(num_covered, 0)
+        FROM editions
+            LEFT JOIN card_totals ON card_totals.edition_id = editions.id
+            LEFT JOIN bundle_totals ON bundle_totals.edition_id = editions.id
+            LEFT JOIN covered ON covered.edition_id = editions.id
+        WHERE editions.pack_id = ?
+        ORDER BY editions.id;''', (pack_id, )).fetchall()
+        stats_fp.write(f'Editions of {pack_id}:\n')
+        table = PrettyTable()
+        table.field_names = ["Edition", "Pack name", "Cards", "Change", "Characters", "Bundles", "C", "R", "SR",
+                             "Chars in a bundle"]
+        for row in results:
+            edition, pack_name, num_cards, change, *rest = row
+            table.add_row((edition, pack_name, num_cards, '' if change is None else f'{change:+d}', *rest))
+        stats_fp.write(str(table))
+        stats_fp.write('\n')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a stats database filled by exports run with --stats-db')
+    parser.add_argument('stats_db', type=str, help='Stats database to read')
+    parser.add_argument('pack_id', type=str, nargs='?',
+                        help='Pack to report on, its --pack-id or else its name. Lists the packs if omitted')
+    parser.add_argument('--edition', type=str, default=None, help='Edition to report on, defaults to the latest')
+    parser.add_argument('--trends', action='store_true', help='Report totals across every edition instead')
+    args = parser.parse_args()
+
+    with StatsWarehouse(args.stats_db) as warehouse:
+        if not args.pack_id:
+            for pack_id, editions in warehouse.db.execute(
+                    'SELECT pack_id, COUNT(*) FROM editions GROUP BY pack_id ORDER BY pack_id;'):
+                print(f'{pack_id}: {editions} editions')
+        elif args.trends:
+            warehouse.print_trends(args.pack_id, sys.stdout)
+        else:
+            warehouse.write_edition_stats(args.pack_id, args.edition or warehouse.latest_edition(args.pack_id),
+                                          sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Feeds a slow stand-in for download_missing_images through CardFeed into
+crop_images, with the crop window replaced by a fake that takes cards from
+the feed the way CropTool.poll_feed does, so no display is needed.
+
+Run with: python -m unittest discover tests
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from nyan_tcg_game import crop_gui
+from nyan_tcg_game.cards import Card, Rarity
+from nyan_tcg_game.image_files import CardFeed
+
+
+def make_card(name):
+    return Card(name=name, variant=None, character=name, company='Company', rarity=Rarity.COMMON,
+                image_credit='', source_url=None, image_file_uri=f'file:{name}.png', local_image_path=None,
+                resized_uri=None, background_fill=(255, 255, 255, 0))
+
+def slow_downloads(steps, finished):
+    """Yields each (delay, card) after sleeping for delay, then sets
+    finished, like download_missing_images on a slow connection"""
+    for delay, card in steps:
+        time.sleep(delay)
+        yield card
+    finished.set()
+
+
+class FakeGui:
+    """Stands in for run_gui. Records the cards the window opened with and
+    picks up the rest from the feed until it is exhausted, or quits
+    straight away"""
+    def __init__(self, finished, quit_early=False):
+        self.finished = finished
+        self.quit_early = quit_early
+        self.opened_with = None
+        self.opened_before_downloads_finished = None
+        self.picked_up = []
+
+    def __call__(self, cards, output_directory, manifest=None, recipes=None, prefetch=None,
+                 prefetch_max_bytes=None, suggestions=None, feed=None, select=None):
+        self.opened_with = list(cards)
+        self.opened_before_downloads_finished = not self.finished.is_set()
+        if not cards or self.quit_early:
+            return
+        while not feed.exhausted:
+            self.picked_up.extend(select(feed.poll(timeout=0.05)))
+
+
+class CropFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.export_dir = self.tmp.name
+        self.image_dir = os.path.join(self.export_dir, 'images')
+        os.makedirs(self.image_dir)
+        self.finished = threading.Event()
+
+    def crop(self, card):
+        """Writes a crop for card, as if it had been cropped on an earlier run"""
+        with open(os.path.join(self.image_dir, card.get_image_filename('.png')), 'wb') as f:
+            f.write(b'crop')
+        return card
+
+    def run_crop_images(self, steps, gui):
+        feed = CardFeed(slow_downloads(steps, self.finished))
+        with mock.patch.object(crop_gui, 'run_gui', gui):
+            return crop_gui.crop_images(feed, self.image_dir, self.export_dir)
+
+    def test_window_opens_before_downloads_finish(self):
+        cropped, last = self.crop(make_card('Cropped')), self.crop(make_card('Last'))
+        first, second = make_card('First'), make_card('Second')
+        gui = FakeGui(self.finished)
+        cards = self.run_crop_images([(0, cropped), (0.05, first), (0.3, second), (0.05, last)], gui)
+
+        self.assertTrue(gui.opened_before_downloads_finished)
+        self.assertEqual(gui.opened_with, [first])
+        self.assertEqual(gui.picked_up, [second])
+        self.assertEqual(cards, [cropped, first, second, last])
+        self.assertEqual([card.resized_uri for card in cards],
+                         [os.path.join('images', card.get_image_filename('.png')) for card in cards])
+
+    def test_no_window_when_everything_is_cropped(self):
+        steps = [(0.05, self.crop(make_card(f'Card {i}'))) for i in range(3)]
+        gui = FakeGui(self.finished)
+        cards = self.run_crop_images(steps, gui)
+
+        self.assertEqual(gui.opened_with, [])
+        self.assertEqual(cards, [card for _, card in steps])
+
+    def test_cards_arriving_after_the_window_closes(self):
+        first, late = make_card('First'), make_card('Late')
+        gui = FakeGui(self.finished, quit_early=True)
+        cards = self.run_crop_images([(0, first), (0.2, late)], gui)
+
+        self.assertEqual(gui.opened_with, [first])
+        self.assertEqual(cards, [first, late])
+        self.assertEqual(late.resized_uri, os.path.join('images', late.get_image_filename('.png')))
+
+    def test_download_error_is_raised(self):
+        def failing():
+            yield make_card('First')
+            time.sleep(0.05)
+            raise OSError('connection reset')
+
+        with mock.patch.object(crop_gui, 'run_gui', FakeGui(self.finished)), \
+             self.assertRaisesRegex(OSError, 'connection reset'):
+            crop_gui.crop_images(CardFeed(failing()), self.image_dir, self.export_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()